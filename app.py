@@ -1,19 +1,20 @@
 """
 Streamlit Dashboard for Dutchie POS Analytics
 """
+import atexit
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+import numpy as np
 from datetime import datetime, timedelta
+import hashlib
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from data_ingestion import load_data_for_all_locations
 from data_cleaning import clean_data, detect_exceptions, validate_data_quality
-from database import DutchieDB
-from config import LOCATIONS, DAYPARTS
-from file_upload import parse_uploaded_file, validate_uploaded_data
+from config import LOCATIONS, DAYPARTS, available_cpus
+from file_upload import parse_uploaded_bytes, validate_uploaded_data
 
 st.set_page_config(
     page_title="Dutchie POS Dashboard",
@@ -21,7 +22,8 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-st.markdown("""
+# All app styles live in one constant, emitted once at the top of every run
+APP_CSS = """
 <style>
     .main-header {
         font-size: 2.5rem;
@@ -31,8 +33,7 @@ st.markdown("""
         margin-bottom: 1rem;
     }
     .metric-card {
-                              if not valid:
-                                st.error(f"{uploaded_file.name}: {message}")    background-color: #f0f2f6;
+        background-color: #f0f2f6;
         padding: 1rem;
         border-radius: 0.5rem;
         margin: 0.5rem 0;
@@ -105,8 +106,73 @@ st.markdown("""
             font-size: 0.9rem;
         }
     }
+    
+    .upload-container {
+        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+        padding: 3rem;
+        border-radius: 20px;
+        text-align: center;
+        margin: 2rem 0;
+        box-shadow: 0 10px 40px rgba(0,0,0,0.1);
+    }
+    .upload-icon {
+        font-size: 5rem;
+        margin-bottom: 1rem;
+        animation: float 3s ease-in-out infinite;
+    }
+    @keyframes float {
+        0%, 100% { transform: translateY(0px); }
+        50% { transform: translateY(-20px); }
+    }
+    .upload-title {
+        font-size: 2.5rem;
+        font-weight: 700;
+        color: white;
+        margin-bottom: 0.5rem;
+    }
+    .upload-subtitle {
+        font-size: 1.2rem;
+        color: rgba(255,255,255,0.9);
+        margin-bottom: 2rem;
+    }
+    .feature-grid {
+        display: grid;
+        grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
+        gap: 1.5rem;
+        margin: 2rem 0;
+    }
+    .feature-card {
+        background: white;
+        padding: 1.5rem;
+        border-radius: 15px;
+        box-shadow: 0 4px 15px rgba(0,0,0,0.1);
+        transition: transform 0.3s ease;
+    }
+    .feature-card:hover {
+        transform: translateY(-5px);
+    }
+    .feature-icon {
+        font-size: 2.5rem;
+        margin-bottom: 0.5rem;
+    }
+    .feature-title {
+        font-size: 1.1rem;
+        font-weight: 600;
+        color: #333;
+        margin-bottom: 0.5rem;
+    }
+    .feature-desc {
+        font-size: 0.9rem;
+        color: #666;
+    }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+st.markdown(APP_CSS, unsafe_allow_html=True)
+
+
+# Money columns in tables are formatted by the frontend instead of as Python strings
+MONEY_COLUMN = st.column_config.NumberColumn(format="$%.2f")
 
 
 @st.cache_data(ttl=300)
@@ -120,24 +186,143 @@ def load_and_process_data(start_date, end_date, use_mock=True):
     return cleaned_data, exceptions, quality_report
 
 
-def initialize_database(cleaned_data):
-    """Initialize and load database"""
+class UploadValidationError(ValueError):
+    """An uploaded file parsed but failed validate_uploaded_data"""
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def load_uploaded_files(uploads):
+    """Parse, validate and clean uploaded (file name, file bytes) pairs
+    
+    Memoized on the file contents, so loading the same exports again skips
+    parsing and cleaning entirely.
+    """
+    frames = {'orders': [], 'line_items': [], 'products': [], 'staff': []}
+    file_names = [file_name for file_name, _ in uploads]
+    location_names = [
+        file_name.removesuffix('.gz').replace('_transactions.csv', '').replace('.csv', '').replace('_', ' ')
+        for file_name in file_names
+    ]
+    file_contents = [file_bytes for _, file_bytes in uploads]
+    
+    # Files are independent and the pyarrow CSV reader releases the GIL, so
+    # several uploads are parsed on threads; forking the threaded server or
+    # pickling each file's bytes to another process is avoided
+    if len(uploads) > 1:
+        with ThreadPoolExecutor(max_workers=min(len(uploads), available_cpus())) as executor:
+            parsed = list(executor.map(parse_uploaded_bytes, file_names, file_contents, location_names))
+    else:
+        parsed = list(map(parse_uploaded_bytes, file_names, file_contents, location_names))
+    
+    for file_name, uploaded_data in zip(file_names, parsed):
+        is_valid, message = validate_uploaded_data(uploaded_data)
+        
+        if not is_valid:
+            raise UploadValidationError(f"{file_name}: {message}")
+        
+        for key, parts in frames.items():
+            parts.append(uploaded_data[key])
+    
+    all_data = {key: pd.concat(parts, ignore_index=True) for key, parts in frames.items()}
+    del frames
+    return clean_data(all_data)
+
+
+@st.cache_resource(show_spinner=False)
+def get_database():
+    """Connected DutchieDB shared by every session and rerun
+    
+    Opening the database file and applying the DuckDB settings happens once
+    per server process rather than on every load. DutchieDB serializes the
+    sessions' use of the connection, which is closed when the server exits.
+    """
+    from database import DutchieDB
+    
     db = DutchieDB()
     db.connect()
     db.create_schema()
-    db.load_data(cleaned_data)
+    atexit.register(db.close)
     return db
 
 
+def data_digest(df_orders, df_line_items):
+    """Content digest of a loaded dataset
+    
+    Keys the per-dataset caches, which are shared by every session, so two
+    different datasets never share an entry however alike their shapes are.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for df in (df_orders, df_line_items):
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def session_data_digest(df_orders, df_line_items):
+    """data_digest of this session's loaded dataset, computed once per load"""
+    if 'data_digest' not in st.session_state:
+        st.session_state['data_digest'] = data_digest(df_orders, df_line_items)
+    return st.session_state['data_digest']
+
+
+@st.cache_data(show_spinner=False)
+def get_filter_options(digest, _df_orders, _df_line_items):
+    """Distinct values for the sidebar filters, computed once per dataset
+    
+    The DataFrames are excluded from the cache key (leading underscore) so
+    Streamlit only hashes the dataset's content digest.
+    """
+    location_ids = (
+        _df_orders[['location_name', 'location_id']]
+        .drop_duplicates()
+        .groupby('location_name', observed=True)['location_id']
+        .agg(list)
+        .to_dict()
+    )
+    
+    return {
+        'min_date': _df_orders['date'].min(),
+        'max_date': _df_orders['date'].max(),
+        'locations': list(_df_orders['location_name'].cat.categories),
+        'location_ids': location_ids,
+        'order_types': list(_df_orders['order_type'].cat.categories),
+        'dayparts': list(_df_orders['daypart'].cat.categories),
+        'categories': list(_df_line_items['category'].cat.categories),
+        'staff': list(_df_orders['staff_id'].cat.categories)
+    }
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def index_line_items_by_order(digest, _df_line_items):
+    """Line items indexed by order_id, built once per dataset and shared read-only
+    
+    Bounded like load_uploaded_files, so the indexes of datasets nobody is
+    looking at anymore do not stay in server memory.
+    """
+    return _df_line_items.set_index('order_id')
+
+
+def build_daily_sales_cube(df_orders):
+    """Non-voided sales by date (sorted rows) and location_id (columns)"""
+    df_sales = df_orders.loc[~df_orders['voided'].values]
+    return df_sales.groupby(['date', 'location_id'], observed=True)['total'].sum().unstack(fill_value=0)
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def daily_sales_cube(digest, _df_orders):
+    """Daily sales cube built once per dataset and shared read-only, for the same few datasets as the line-item index"""
+    return build_daily_sales_cube(_df_orders)
+
+
 def render_filters(df_orders, df_line_items):
     """Render sidebar filters"""
     
     st.sidebar.header("Filters")
     
     filters = {}
+    options = get_filter_options(session_data_digest(df_orders, df_line_items), df_orders, df_line_items)
     
-    min_date = df_orders['date'].min()
-    max_date = df_orders['date'].max()
+    min_date = options['min_date']
+    max_date = options['max_date']
     
     if hasattr(min_date, 'date'):
         min_date = min_date.date()
@@ -170,7 +355,7 @@ def render_filters(df_orders, df_line_items):
         filters['start_date'] = min_date
         filters['end_date'] = max_date
     
-    all_locations = df_orders['location_name'].unique()
+    all_locations = options['locations']
     
     locations = st.sidebar.multiselect(
         "Location(s)",
@@ -179,12 +364,12 @@ def render_filters(df_orders, df_line_items):
     )
     
     if locations:
-        location_ids = df_orders[df_orders['location_name'].isin(locations)]['location_id'].unique().tolist()
+        location_ids = [loc_id for name in locations for loc_id in options['location_ids'].get(name, [])]
         filters['locations'] = location_ids
     
     order_type = st.sidebar.selectbox(
         "Order Type",
-        options=['All'] + list(df_orders['order_type'].unique()),
+        options=['All'] + options['order_types'],
         index=0
     )
     if order_type != 'All':
@@ -194,12 +379,12 @@ def render_filters(df_orders, df_line_items):
         "Daypart",
         options=['All'] + list(DAYPARTS.keys()),
         index=0,
-        help=f"Available in data: {sorted(df_orders['daypart'].unique())}"
+        help=f"Available in data: {options['dayparts']}"
     )
     if daypart != 'All':
         filters['daypart'] = daypart
     
-    available_categories = sorted(df_line_items['category'].unique())
+    available_categories = options['categories']
     category = st.sidebar.selectbox(
         "Category",
         options=['All'] + available_categories,
@@ -208,7 +393,7 @@ def render_filters(df_orders, df_line_items):
     if category != 'All':
         filters['category'] = category
     
-    staff_options = df_orders['staff_id'].unique()
+    staff_options = options['staff']
     staff = st.sidebar.selectbox(
         "Cashier",
         options=['All'] + list(staff_options),
@@ -220,44 +405,94 @@ def render_filters(df_orders, df_line_items):
     return filters
 
 
-def apply_filters(df, filters, is_line_items=False):
-    """Apply filters to dataframe"""
-    filtered_df = df.copy()
-    
-    if is_line_items:
-        if 'category' in filters:
-            filtered_df = filtered_df[filtered_df['category'] == filters['category']]
-        return filtered_df
+def slice_date_range(df, start_date, end_date):
+    """Return rows between two dates (inclusive) from a frame sorted by date"""
+    lo = df['date'].searchsorted(start_date, side='left')
+    hi = df['date'].searchsorted(end_date, side='right')
+    return df.iloc[lo:hi]
+
+
+def apply_filters(df, filters):
+    """Apply order filters to dataframe
     
+    All predicates are combined into a single boolean mask so the frame is
+    only sliced once (no intermediate copies per filter). Orders are sorted
+    by date during cleaning, so the date range is taken as a contiguous slice.
+    """
     if 'start_date' in filters and 'end_date' in filters:
-        filtered_df = filtered_df[
-            (filtered_df['date'] >= filters['start_date']) &
-            (filtered_df['date'] <= filters['end_date'])
-        ]
+        df = slice_date_range(df, filters['start_date'], filters['end_date'])
+    
+    mask = np.ones(len(df), dtype=bool)
     
     if 'locations' in filters and filters['locations']:
-        filtered_df = filtered_df[filtered_df['location_id'].isin(filters['locations'])]
+        mask &= df['location_id'].isin(filters['locations']).to_numpy()
     
     if 'order_type' in filters:
-        filtered_df = filtered_df[filtered_df['order_type'] == filters['order_type']]
+        mask &= df['order_type'].values == filters['order_type']
     
     if 'daypart' in filters:
-        filtered_df = filtered_df[filtered_df['daypart'] == filters['daypart']]
+        mask &= df['daypart'].values == filters['daypart']
     
     if 'staff_id' in filters:
-        filtered_df = filtered_df[filtered_df['staff_id'] == filters['staff_id']]
+        mask &= df['staff_id'].values == filters['staff_id']
     
-    return filtered_df
+    return df[mask]
 
 
-def render_kpi_cards(df_orders, df_line_items):
+def order_id_mask(order_ids, selected_order_ids):
+    """Boolean mask of order_ids present in selected_order_ids
+    
+    Both columns share clean_data's order_id categorical dtype, so membership
+    is a lookup of category codes in a flag array; code -1 (missing) lands in
+    the extra trailing slot.
+    """
+    if order_ids.dtype != selected_order_ids.dtype:
+        return order_ids.isin(selected_order_ids).to_numpy()
+    selected = np.zeros(len(order_ids.cat.categories) + 1, dtype=bool)
+    selected[selected_order_ids.cat.codes.to_numpy()] = True
+    return selected[order_ids.cat.codes.to_numpy()]
+
+
+def sorted_sum(keys, values):
+    """Sum values over runs of equal keys, for keys already sorted/contiguous
+    
+    Skips the hash table a groupby would build; returns (run keys, run sums).
+    """
+    if len(keys) == 0:
+        return keys, values
+    starts = np.r_[0, np.flatnonzero(keys[1:] != keys[:-1]) + 1]
+    return keys[starts], np.add.reduceat(values, starts)
+
+
+def build_hourly_cube(df_orders):
+    """Aggregate orders to one row per (date, hour) for the exception and heatmap panels"""
+    return df_orders.groupby(['date', 'hour'], sort=False, observed=True).agg(
+        transactions=('order_id', 'count'),
+        voids=('voided', 'sum'),
+        refunds=('refunded', 'sum'),
+        discounts=('has_discount', 'sum')
+    ).reset_index()
+
+
+def build_product_cube(df_line_items):
+    """Aggregate line items to one row per product for the KPI and movers panels"""
+    return df_line_items.groupby(['product_name', 'category'], observed=True).agg(
+        total=('total', 'sum'),
+        margin=('margin', 'sum'),
+        quantity=('quantity', 'sum')
+    ).reset_index()
+
+
+def render_kpi_cards(df_sales, product_cube):
     """Render main KPI cards"""
-    df_sales = df_orders[~df_orders['voided']].copy()
+    totals = df_sales[['total', 'total_tax']].sum()
+    net_sales = totals['total']
+    total_tax = totals['total_tax']
+    total_margin = product_cube['margin'].sum()
     
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        net_sales = df_sales['total'].sum()
         st.metric(
             "Total Net Sales", 
             f"${net_sales:,.2f}",
@@ -273,7 +508,6 @@ def render_kpi_cards(df_orders, df_line_items):
         )
     
     with col3:
-        total_margin = df_line_items['margin'].sum() if 'margin' in df_line_items.columns else 0
         margin_pct = (total_margin / net_sales * 100) if net_sales > 0 else 0
         st.metric(
             "Gross Margin %", 
@@ -282,7 +516,6 @@ def render_kpi_cards(df_orders, df_line_items):
         )
     
     with col4:
-        total_tax = df_sales['total_tax'].sum()
         st.metric(
             "Total Tax Collected", 
             f"${total_tax:,.2f}",
@@ -290,29 +523,28 @@ def render_kpi_cards(df_orders, df_line_items):
         )
 
 
-def render_sales_comparison(df_orders, filters):
+def render_sales_comparison(df_sales, filters):
     """Render week-over-week sales comparison"""
-    df_sales = df_orders[~df_orders['voided']].copy()
+    # Plotly and the DB client are imported where used so the upload screen
+    # renders without loading them
+    import plotly.express as px
     
     current_sales = df_sales['total'].sum()
     current_orders = len(df_sales)
     
-    all_orders = st.session_state.get('all_orders', df_orders)
+    daily_cube = st.session_state.get('daily_sales_cube')
+    if daily_cube is None:
+        daily_cube = build_daily_sales_cube(df_sales)
     
     days_diff = (filters['end_date'] - filters['start_date']).days + 1
     prev_start = filters['start_date'] - timedelta(days=days_diff)
     prev_end = filters['start_date'] - timedelta(days=1)
     
-    df_prev = all_orders[
-        (all_orders['date'] >= prev_start) &
-        (all_orders['date'] <= prev_end) &
-        (~all_orders['voided'])
-    ]
-    
+    prev_cube = daily_cube.loc[prev_start:prev_end]
     if 'locations' in filters and filters['locations']:
-        df_prev = df_prev[df_prev['location_id'].isin(filters['locations'])]
+        prev_cube = prev_cube.reindex(columns=filters['locations'], fill_value=0)
     
-    prev_sales = df_prev['total'].sum() if len(df_prev) > 0 else 0
+    prev_sales = prev_cube.to_numpy(dtype=np.float64).sum()
     
     if prev_sales > 0:
         pct_change = ((current_sales - prev_sales) / prev_sales) * 100
@@ -342,34 +574,32 @@ def render_sales_comparison(df_orders, filters):
     
     if 'locations' in filters and len(filters['locations']) > 1:
         st.write("**Sales by Location:**")
-        location_sales = df_sales.groupby('location_name')['total'].sum().reset_index()
-        location_sales.columns = ['Location', 'Sales']
-        location_sales['Sales'] = location_sales['Sales'].apply(lambda x: f"${x:,.2f}")
+        location_sales = df_sales.groupby('location_name', observed=True)['total'].sum()
         
         cols = st.columns(len(location_sales))
-        for idx, (_, row) in enumerate(location_sales.iterrows()):
-            with cols[idx]:
-                st.metric(row['Location'], row['Sales'])
+        for col, (location, sales) in zip(cols, location_sales.items()):
+            with col:
+                st.metric(location, f"${sales:,.2f}")
     
-    daily_sales = df_sales.groupby('date')['total'].sum().reset_index()
+    dates, daily_totals = sorted_sum(df_sales['date'].to_numpy(), df_sales['total'].to_numpy(dtype=np.float64))
     fig = px.line(
-        daily_sales,
-        x='date',
-        y='total',
+        x=dates,
+        y=daily_totals,
         title='Daily Sales Trend',
-        labels={'total': 'Sales ($)', 'date': 'Date'}
+        labels={'y': 'Sales ($)', 'x': 'Date'}
     )
     st.plotly_chart(fig, use_container_width=True)
 
 
-def render_basket_economics(df_orders):
+def render_basket_economics(df_sales):
     """Render basket economics section"""
-    df_sales = df_orders[~df_orders['voided']].copy()
+    import plotly.express as px
     
     if 'line_items_for_basket' in st.session_state:
+        # Line items are indexed by order_id, so the semi-join reuses that hash index
         df_line_items = st.session_state['line_items_for_basket']
         filtered_order_ids = df_sales['order_id'].unique()
-        df_line_items_filtered = df_line_items[df_line_items['order_id'].isin(filtered_order_ids)]
+        df_line_items_filtered = df_line_items.loc[df_line_items.index.intersection(filtered_order_ids)]
     else:
         df_line_items_filtered = None
     
@@ -407,7 +637,7 @@ def render_basket_economics(df_orders):
     col1, col2 = st.columns(2)
     
     with col1:
-        tender_mix = df_sales.groupby('tender_type')['total'].sum().reset_index()
+        tender_mix = df_sales.groupby('tender_type', observed=True)['total'].sum().reset_index()
         tender_mix['percentage'] = tender_mix['total'] / tender_mix['total'].sum() * 100
         
         fig = px.pie(
@@ -419,7 +649,7 @@ def render_basket_economics(df_orders):
         st.plotly_chart(fig, use_container_width=True)
     
     with col2:
-        order_type_dist = df_sales.groupby('order_type')['total'].sum().reset_index()
+        order_type_dist = df_sales.groupby('order_type', observed=True)['total'].sum().reset_index()
         
         fig = px.bar(
             order_type_dist,
@@ -431,10 +661,8 @@ def render_basket_economics(df_orders):
         st.plotly_chart(fig, use_container_width=True)
 
 
-def render_discount_analysis(df_orders):
+def render_discount_analysis(df_sales):
     """Render discount and promo analysis"""
-    df_sales = df_orders[~df_orders['voided']].copy()
-    
     with_discount = df_sales[df_sales['discount'] > 0]
     without_discount = df_sales[df_sales['discount'] == 0]
     
@@ -466,7 +694,8 @@ def render_discount_analysis(df_orders):
         )
     
     if 'promo_code' in df_sales.columns:
-        top_promos = df_sales[df_sales['promo_code'].notna()].groupby('promo_code').agg({
+        # groupby drops missing promo codes on its own, no notna() pre-filter needed
+        top_promos = df_sales.groupby('promo_code', observed=True).agg({
             'order_id': 'count',
             'discount': 'sum',
             'total': 'sum'
@@ -475,11 +704,18 @@ def render_discount_analysis(df_orders):
         top_promos = top_promos.sort_values('Total Discount', ascending=False).head(5)
         
         st.write("**Top Active Promos:**")
-        st.dataframe(top_promos, use_container_width=True, hide_index=True)
+        st.dataframe(
+            top_promos,
+            use_container_width=True,
+            hide_index=True,
+            column_config={'Total Discount': MONEY_COLUMN, 'Sales': MONEY_COLUMN}
+        )
 
 
-def render_exceptions(df_orders, exceptions_df):
+def render_exceptions(df_orders, hourly_cube, exceptions_df):
     """Render voids/refunds exceptions"""
+    import plotly.express as px
+    
     col1, col2, col3 = st.columns(3)
     
     with col1:
@@ -499,8 +735,8 @@ def render_exceptions(df_orders, exceptions_df):
         )
     
     with col3:
-        daily_voids = df_orders.groupby('date')['voided'].sum()
-        median_voids = daily_voids.median() if len(daily_voids) > 0 else 0
+        _, daily_voids = sorted_sum(hourly_cube['date'].to_numpy(), hourly_cube['voids'].to_numpy(dtype=np.float64))
+        median_voids = np.median(daily_voids) if len(daily_voids) > 0 else 0
         st.metric(
             "Daily Median Voids", 
             f"{median_voids:.0f}",
@@ -511,7 +747,7 @@ def render_exceptions(df_orders, exceptions_df):
     
     with col1:
         st.write("**Void Rate by Budtender (Top 10)**")
-        staff_exceptions = df_orders.groupby('staff_id').agg({
+        staff_exceptions = df_orders.groupby('staff_id', observed=True).agg({
             'voided': 'sum',
             'refunded': 'sum',
             'order_id': 'count'
@@ -530,12 +766,14 @@ def render_exceptions(df_orders, exceptions_df):
     
     with col2:
         st.write("**Void/Refund Rate by Hour**")
-        hourly_exceptions = df_orders.groupby('hour').agg({
-            'voided': 'sum',
-            'refunded': 'sum',
-            'order_id': 'count'
-        }).reset_index()
-        hourly_exceptions['exception_rate'] = (hourly_exceptions['voided'] + hourly_exceptions['refunded']) / hourly_exceptions['order_id'] * 100
+        # Hours are small non-negative ints, so a bincount replaces the groupby
+        hours = hourly_cube['hour'].to_numpy(dtype=np.intp)
+        hourly_exceptions = pd.DataFrame({
+            col: np.bincount(hours, weights=hourly_cube[col].to_numpy(dtype=np.float64), minlength=24)
+            for col in ['voids', 'refunds', 'transactions']
+        }).rename_axis('hour').reset_index()
+        hourly_exceptions = hourly_exceptions[hourly_exceptions['transactions'] > 0]
+        hourly_exceptions['exception_rate'] = (hourly_exceptions['voids'] + hourly_exceptions['refunds']) / hourly_exceptions['transactions'] * 100
         
         fig = px.line(
             hourly_exceptions,
@@ -548,32 +786,28 @@ def render_exceptions(df_orders, exceptions_df):
         st.plotly_chart(fig, use_container_width=True)
 
 
-def render_top_movers(df_line_items, df_products):
+def render_top_movers(product_totals, df_products):
     """Render top/bottom movers"""
+    import plotly.graph_objects as go
+    
     col1, col2 = st.columns(2)
     
     with col1:
         st.write("**Top 10 SKUs by Net Sales**")
-        top_by_sales = df_line_items.groupby(['product_name', 'category']).agg({
-            'total': 'sum',
-            'quantity': 'sum'
-        }).reset_index()
-        top_by_sales = top_by_sales.sort_values('total', ascending=False).head(10)
+        top_by_sales = product_totals.sort_values('total', ascending=False).head(10)
+        top_by_sales = top_by_sales[['product_name', 'category', 'total', 'quantity']]
         top_by_sales.columns = ['Product', 'Category', 'Sales ($)', 'Units']
-        st.dataframe(top_by_sales, use_container_width=True, hide_index=True)
+        st.dataframe(top_by_sales, use_container_width=True, hide_index=True, column_config={'Sales ($)': MONEY_COLUMN})
     
     with col2:
         st.write("**Top 10 SKUs by Margin $**")
-        top_by_margin = df_line_items.groupby(['product_name', 'category']).agg({
-            'margin': 'sum',
-            'quantity': 'sum'
-        }).reset_index()
-        top_by_margin = top_by_margin.sort_values('margin', ascending=False).head(10)
+        top_by_margin = product_totals.sort_values('margin', ascending=False).head(10)
+        top_by_margin = top_by_margin[['product_name', 'category', 'margin', 'quantity']]
         top_by_margin.columns = ['Product', 'Category', 'Margin ($)', 'Units']
-        st.dataframe(top_by_margin, use_container_width=True, hide_index=True)
+        st.dataframe(top_by_margin, use_container_width=True, hide_index=True, column_config={'Margin ($)': MONEY_COLUMN})
     
     st.write("**Category Contribution (Pareto 80/20)**")
-    category_sales = df_line_items.groupby('category')['total'].sum().reset_index()
+    category_sales = product_totals.groupby('category', observed=True)['total'].sum().reset_index()
     category_sales = category_sales.sort_values('total', ascending=False)
     category_sales['cumulative_pct'] = category_sales['total'].cumsum() / category_sales['total'].sum() * 100
     category_sales['sales_pct'] = category_sales['total'] / category_sales['total'].sum() * 100
@@ -584,7 +818,7 @@ def render_top_movers(df_line_items, df_products):
         y=category_sales['sales_pct'],
         name='Sales %',
         yaxis='y',
-        text=category_sales['sales_pct'].apply(lambda x: f'{x:.1f}%'),
+        texttemplate='%{y:.1f}%',
         textposition='auto'
     ))
     fig.add_trace(go.Scatter(
@@ -606,9 +840,9 @@ def render_top_movers(df_line_items, df_products):
     st.plotly_chart(fig, use_container_width=True)
 
 
-def render_compliance_panel(df_orders, exceptions_df):
+def render_compliance_panel(df_orders, df_sales, exceptions_df):
     """Render compliance-friendly panel"""
-    df_sales = df_orders[~df_orders['voided']].copy()
+    import plotly.express as px
     
     # Filter exceptions to only show issues from currently visible orders
     filtered_order_ids = df_orders['order_id'].unique()
@@ -629,14 +863,12 @@ def render_compliance_panel(df_orders, exceptions_df):
         st.plotly_chart(fig, use_container_width=True)
     
     with col2:
-        tax_breakdown = pd.DataFrame({
-            'Tax Type': ['Excise', 'State', 'Local'],
-            'Amount': [
-                df_sales['excise_tax'].sum(),
-                df_sales['state_tax'].sum(),
-                df_sales['local_tax'].sum()
-            ]
-        })
+        tax_breakdown = (
+            df_sales[['excise_tax', 'state_tax', 'local_tax']].sum()
+            .rename({'excise_tax': 'Excise', 'state_tax': 'State', 'local_tax': 'Local'})
+            .rename_axis('Tax Type')
+            .reset_index(name='Amount')
+        )
         
         fig = px.bar(tax_breakdown, x='Tax Type', y='Amount', title='Tax Breakdown')
         st.plotly_chart(fig, use_container_width=True)
@@ -653,52 +885,53 @@ def render_compliance_panel(df_orders, exceptions_df):
         st.success("No compliance issues detected")
 
 
-def render_heatmap(df_orders):
+HEATMAP_MAX_DATE_ROWS = 60
+
+
+def heatmap_matrix(cube, value_col):
+    """Pivot one cube measure into (dates, hours, float32 matrix) for px.imshow"""
+    pivot = cube.pivot(index='date', columns='hour', values=value_col)
+    return list(pivot.index), list(pivot.columns), pivot.to_numpy(dtype=np.float32, na_value=0)
+
+
+def render_heatmap(hourly_cube):
     """Render hourly heatmap"""
-    hourly_data = df_orders.groupby(['date', 'hour']).agg({
-        'order_id': 'count',
-        'voided': 'sum',
-        'discount': lambda x: (x > 0).sum()
-    }).reset_index()
-    hourly_data.columns = ['date', 'hour', 'transactions', 'voids', 'discounts']
-    
-    tab1, tab2, tab3 = st.tabs(["Transaction Throughput", "Void Activity", "Discount Activity"])
-    
-    with tab1:
-        st.write("**Transaction volume by hour to identify peak times**")
-        heatmap_data = hourly_data.pivot(index='date', columns='hour', values='transactions').fillna(0)
-        fig = px.imshow(
-            heatmap_data,
-            labels=dict(x="Hour", y="Date", color="Transactions"),
-            title="",
-            aspect="auto",
-            color_continuous_scale="Blues"
+    import plotly.express as px
+    
+    cube = hourly_cube
+    date_label = "Date"
+    if cube['date'].nunique() > HEATMAP_MAX_DATE_ROWS:
+        # Bin long ranges by week so rows stay readable and the chart payload shrinks
+        weeks = pd.to_datetime(cube['date']).dt.to_period('W').dt.start_time.dt.date
+        cube = (
+            cube.assign(date=weeks.values)
+            .groupby(['date', 'hour'], sort=False, observed=True)[['transactions', 'voids', 'discounts']]
+            .sum()
+            .reset_index()
         )
-        st.plotly_chart(fig, use_container_width=True)
+        date_label = "Week of"
     
-    with tab2:
-        st.write("**Void activity by hour to spot coaching windows**")
-        heatmap_data = hourly_data.pivot(index='date', columns='hour', values='voids').fillna(0)
-        fig = px.imshow(
-            heatmap_data,
-            labels=dict(x="Hour", y="Date", color="Voids"),
-            title="",
-            aspect="auto",
-            color_continuous_scale="Reds"
-        )
-        st.plotly_chart(fig, use_container_width=True)
+    tabs = st.tabs(["Transaction Throughput", "Void Activity", "Discount Activity"])
+    panels = [
+        ("**Transaction volume by hour to identify peak times**", 'transactions', "Transactions", "Blues"),
+        ("**Void activity by hour to spot coaching windows**", 'voids', "Voids", "Reds"),
+        ("**Discount activity by hour**", 'discounts', "Discounts", "Greens")
+    ]
     
-    with tab3:
-        st.write("**Discount activity by hour**")
-        heatmap_data = hourly_data.pivot(index='date', columns='hour', values='discounts').fillna(0)
-        fig = px.imshow(
-            heatmap_data,
-            labels=dict(x="Hour", y="Date", color="Discounts"),
-            title="",
-            aspect="auto",
-            color_continuous_scale="Greens"
-        )
-        st.plotly_chart(fig, use_container_width=True)
+    for tab, (caption, value_col, color_label, color_scale) in zip(tabs, panels):
+        with tab:
+            st.write(caption)
+            dates, hours, values = heatmap_matrix(cube, value_col)
+            fig = px.imshow(
+                values,
+                x=hours,
+                y=dates,
+                labels=dict(x="Hour", y=date_label, color=color_label),
+                title="",
+                aspect="auto",
+                color_continuous_scale=color_scale
+            )
+            st.plotly_chart(fig, use_container_width=True)
 
 
 def render_notes_section():
@@ -716,69 +949,7 @@ def render_notes_section():
 
 def render_upload_interface():
     """Render file upload interface when no data is loaded"""
-    
     st.markdown("""
-    <style>
-        .upload-container {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            padding: 3rem;
-            border-radius: 20px;
-            text-align: center;
-            margin: 2rem 0;
-            box-shadow: 0 10px 40px rgba(0,0,0,0.1);
-        }
-        .upload-icon {
-            font-size: 5rem;
-            margin-bottom: 1rem;
-            animation: float 3s ease-in-out infinite;
-        }
-        @keyframes float {
-            0%, 100% { transform: translateY(0px); }
-            50% { transform: translateY(-20px); }
-        }
-        .upload-title {
-            font-size: 2.5rem;
-            font-weight: 700;
-            color: white;
-            margin-bottom: 0.5rem;
-        }
-        .upload-subtitle {
-            font-size: 1.2rem;
-            color: rgba(255,255,255,0.9);
-            margin-bottom: 2rem;
-        }
-        .feature-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-            gap: 1.5rem;
-            margin: 2rem 0;
-        }
-        .feature-card {
-            background: white;
-            padding: 1.5rem;
-            border-radius: 15px;
-            box-shadow: 0 4px 15px rgba(0,0,0,0.1);
-            transition: transform 0.3s ease;
-        }
-        .feature-card:hover {
-            transform: translateY(-5px);
-        }
-        .feature-icon {
-            font-size: 2.5rem;
-            margin-bottom: 0.5rem;
-        }
-        .feature-title {
-            font-size: 1.1rem;
-            font-weight: 600;
-            color: #333;
-            margin-bottom: 0.5rem;
-        }
-        .feature-desc {
-            font-size: 0.9rem;
-            color: #666;
-        }
-    </style>
-    
     <div class='upload-container'>
         <div class='upload-icon'>📊</div>
         <div class='upload-title'>Welcome to Dutchie POS Dashboard</div>
@@ -809,9 +980,9 @@ def render_upload_interface():
         
         uploaded_files = st.file_uploader(
             "Choose CSV files",
-            type=['csv'],
+            type=['csv', 'gz'],
             accept_multiple_files=True,
-            help="Upload transaction files (e.g., Columbus_transactions.csv, Cincinnati_transactions.csv)",
+            help="Upload transaction files (e.g., Columbus_transactions.csv, Cincinnati_transactions.csv.gz)",
             label_visibility="collapsed"
         )
         
@@ -821,38 +992,31 @@ def render_upload_interface():
             for uploaded_file in uploaded_files:
                 st.write(f"📄 {uploaded_file.name}")
             
-            if st.button("🚀 Load Data", type="primary", use_container_width=True):
+            # The uploader can only filter on the last extension, so any .gz
+            # gets through; only gzip-compressed CSV exports are supported
+            unsupported = [
+                uploaded_file.name for uploaded_file in uploaded_files
+                if not uploaded_file.name.lower().endswith(('.csv', '.csv.gz'))
+            ]
+            if unsupported:
+                st.error(f"❌ Unsupported file type: {', '.join(unsupported)}. Please upload .csv or .csv.gz files.")
+            elif st.button("🚀 Load Data", type="primary", use_container_width=True):
                 with st.spinner("Processing files and loading into database..."):
                     try:
-                        all_data = {'orders': [], 'line_items': [], 'products': [], 'staff': []}
-                        
-                        for uploaded_file in uploaded_files:
-                            location_name = uploaded_file.name.replace('_transactions.csv', '').replace('.csv', '').replace('_', ' ')
-                            
-                            uploaded_data = parse_uploaded_file(uploaded_file, location_name)
-                            is_valid, message = validate_uploaded_data(uploaded_data)
-                            
-                            if not is_valid:
-                                st.error(f"❌ {uploaded_file.name}: {message}")
-                                return
-                            
-                            all_data['orders'].extend(uploaded_data['orders'])
-                            all_data['line_items'].extend(uploaded_data['line_items'])
-                            all_data['products'].extend(uploaded_data['products'])
-                            all_data['staff'].extend(uploaded_data['staff'])
-                        
-                        cleaned_data = clean_data(all_data)
+                        uploads = tuple((uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files)
+                        try:
+                            cleaned_data = load_uploaded_files(uploads)
+                        except UploadValidationError as e:
+                            st.error(f"❌ {e}")
+                            return
                         exceptions = detect_exceptions(cleaned_data['orders'])
                         
-                        db = DutchieDB()
-                        db.connect()
-                        db.create_schema()
-                        db.load_data(cleaned_data)
-                        db.close()
+                        get_database().load_data(cleaned_data)
                         
                         st.session_state['cleaned_data'] = cleaned_data
                         st.session_state['exceptions'] = exceptions
                         st.session_state['data_loaded'] = True
+                        st.session_state.pop('data_digest', None)
                         
                         st.success("✅ Data loaded successfully!")
                         time.sleep(1)
@@ -884,6 +1048,7 @@ def main():
             del st.session_state['cleaned_data']
         if 'exceptions' in st.session_state:
             del st.session_state['exceptions']
+        st.session_state.pop('data_digest', None)
         st.rerun()
     
     cleaned_data = st.session_state['cleaned_data']
@@ -894,8 +1059,9 @@ def main():
     df_products = cleaned_data['products']
     df_staff = cleaned_data['staff']
     
-    st.session_state['all_orders'] = df_orders.copy()
-    st.session_state['line_items_for_basket'] = df_line_items.copy()
+    digest = session_data_digest(df_orders, df_line_items)
+    st.session_state['daily_sales_cube'] = daily_sales_cube(digest, df_orders)
+    st.session_state['line_items_for_basket'] = index_line_items_by_order(digest, df_line_items)
     
     if len(df_orders) == 0:
         st.markdown("""
@@ -909,7 +1075,7 @@ def main():
     
     filters = render_filters(df_orders, df_line_items)
     
-    df_orders_filtered = apply_filters(df_orders, filters, is_line_items=False)
+    df_orders_filtered = apply_filters(df_orders, filters)
     
     if len(df_orders_filtered) == 0:
         st.markdown("""
@@ -921,53 +1087,59 @@ def main():
         """, unsafe_allow_html=True)
         st.stop()
     
-    filtered_order_ids = df_orders_filtered['order_id'].unique()
-    df_line_items_filtered = df_line_items[df_line_items['order_id'].isin(filtered_order_ids)]
-    
-    df_line_items_filtered = apply_filters(df_line_items_filtered, filters, is_line_items=True)
+    line_item_mask = order_id_mask(df_line_items['order_id'], df_orders_filtered['order_id'])
+    if 'category' in filters:
+        line_item_mask &= df_line_items['category'].values == filters['category']
+    df_line_items_filtered = df_line_items[line_item_mask]
     
     if 'category' in filters:
-        category_order_ids = df_line_items_filtered['order_id'].unique()
-        df_orders_filtered = df_orders_filtered[df_orders_filtered['order_id'].isin(category_order_ids)]
+        df_orders_filtered = df_orders_filtered[
+            order_id_mask(df_orders_filtered['order_id'], df_line_items_filtered['order_id'])
+        ]
+    
+    # Non-voided orders are shared read-only by every sales panel
+    df_sales = df_orders_filtered.loc[~df_orders_filtered['voided'].values]
+    hourly_cube = build_hourly_cube(df_orders_filtered)
+    product_cube = build_product_cube(df_line_items_filtered)
     
-    render_kpi_cards(df_orders_filtered, df_line_items_filtered)
+    render_kpi_cards(df_sales, product_cube)
     
     st.divider()
     
     st.header("1. Net Sales & Same-Store")
-    render_sales_comparison(df_orders_filtered, filters)
+    render_sales_comparison(df_sales, filters)
     
     st.divider()
     
     st.header("2. Basket Economics")
-    render_basket_economics(df_orders_filtered)
+    render_basket_economics(df_sales)
     
     st.divider()
     
     st.header("3. Discount/Promo Impact")
-    render_discount_analysis(df_orders_filtered)
+    render_discount_analysis(df_sales)
     
     st.divider()
     
     st.header("4. Voids/Refunds Exception Monitor")
-    render_exceptions(df_orders_filtered, exceptions)
+    render_exceptions(df_orders_filtered, hourly_cube, exceptions)
     
     st.divider()
     
     # 5. TOP/BOTTOM MOVERS
     st.header("5. Top/Bottom Movers")
-    render_top_movers(df_line_items_filtered, df_products)
+    render_top_movers(product_cube, df_products)
     
     st.divider()
     
     # 6. COMPLIANCE-FRIENDLY PANEL
     st.header("6. Compliance-Friendly Panel")
-    render_compliance_panel(df_orders_filtered, exceptions)
+    render_compliance_panel(df_orders_filtered, df_sales, exceptions)
     
     st.divider()
     
     st.header("7. Heatmap by Hour")
-    render_heatmap(df_orders_filtered)
+    render_heatmap(hourly_cube)
     
     st.divider()
     
@@ -1,6 +1,11 @@
 """
 Configuration file for Dutchie POS Dashboard
 """
+import hashlib
+import os
+from functools import lru_cache
+
+import pytz
 
 API_KEYS = {
     "Columbus": "eb0a049ab2f34161b9cd79beedd20d5d",
@@ -24,28 +29,51 @@ LOCATIONS = {
 
 DEFAULT_TIMEZONE = "America/New_York"
 
+def stable_location_hash(location_name):
+    """Four-digit hash of a location name that, unlike hash(), is the same in every process"""
+    digest = hashlib.blake2b(location_name.encode(), digest_size=2).digest()
+    return int.from_bytes(digest, 'big') % 10000
+
+
+def available_cpus():
+    """CPUs this process may run on, which cgroups or taskset can limit below os.cpu_count()"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+@lru_cache(maxsize=None)
 def get_location_config(location_name):
     """Get location configuration with fallback for uploaded locations"""
     if location_name in LOCATIONS:
         return LOCATIONS[location_name]
     else:
         return {
-            "id": f"loc_{hash(location_name) % 10000:04d}",
+            "id": f"loc_{stable_location_hash(location_name):04d}",
             "name": location_name,
             "timezone": DEFAULT_TIMEZONE,
             "api_key": None
         }
 
 
+@lru_cache(maxsize=None)
+def get_location_tz(location_name):
+    """Get the pytz timezone object for a location"""
+    return pytz.timezone(get_location_config(location_name)['timezone'])
+
+
 def register_uploaded_location(location_name, timezone=None):
     """Register a new uploaded location in the LOCATIONS dict"""
     if location_name not in LOCATIONS:
         LOCATIONS[location_name] = {
-            "id": f"loc_{hash(location_name) % 10000:04d}",
+            "id": f"loc_{stable_location_hash(location_name):04d}",
             "name": location_name,
             "timezone": timezone or DEFAULT_TIMEZONE,
             "api_key": None
         }
+        # The location may already have been resolved through the fallback config
+        get_location_config.cache_clear()
+        get_location_tz.cache_clear()
 
 STORE_HOURS = {
     "open": 9,
@@ -67,11 +95,22 @@ THRESHOLDS = {
 
 DB_PATH = "dutchie_pos.db"
 
+CACHE_DIR = ".cache"
+
+# DuckDB resources, sized for the deployment host instead of auto-detected;
+# a memory_limit near physical RAM makes the host swap before DuckDB spills
+DB_SETTINGS = {
+    "threads": 4,
+    "memory_limit": "2GB",
+    "temp_directory": os.path.join(CACHE_DIR, "duckdb")
+}
+
 API_BASE_URL = "https://api.pos.dutchie.com"
 
 MOCK_DATA_CONFIG = {
     "days_of_data": 56,  # 8 weeks of data for period-over-period comparisons
     "transactions_per_day": (50, 150),
     "products_count": 50,
-    "staff_count": 8
+    "staff_count": 8,
+    "export_format": "csv"  # "parquet" for a faster, smaller export the uploader cannot read
 }
@@ -1,10 +1,33 @@
 """
 Data cleaning and transformation module
 """
+import numpy as np
 import pandas as pd
-import pytz
 from datetime import datetime
-from config import LOCATIONS, DAYPARTS, THRESHOLDS
+from config import LOCATIONS, DAYPARTS, THRESHOLDS, get_location_tz
+
+# Low-cardinality string columns kept as pandas categoricals so filters and
+# groupbys compare integer codes instead of Python strings
+ORDER_CATEGORICAL_COLUMNS = ['location_name', 'order_type', 'daypart', 'tender_type', 'promo_code', 'staff_id', 'day_of_week']
+LINE_ITEM_CATEGORICAL_COLUMNS = ['category', 'product_id', 'product_name']
+
+# Narrow numeric types for the fact tables. Money columns and discount_rate
+# stay float64 because float32 values and sums surface as off-by-a-fraction
+# values (16.94 reads back as 16.940000534057617) in tables and reports.
+ORDER_NUMERIC_DTYPES = {
+    'discount_rate': 'double[pyarrow]',
+    'hour': 'uint8[pyarrow]'
+}
+LINE_ITEM_NUMERIC_DTYPES = {
+    'quantity': 'int32[pyarrow]'
+}
+
+# DAYPARTS are contiguous [start, end) hour ranges, so their bounds double as
+# pd.cut bin edges; hours outside every range fall through to 'Other'
+DAYPART_LABELS = list(DAYPARTS)
+DAYPART_BINS = [start for start, _ in DAYPARTS.values()] + [list(DAYPARTS.values())[-1][1]]
+
+EXCEPTION_COLUMNS = ['type', 'order_id', 'location', 'timestamp', 'value', 'description']
 
 
 def clean_data(raw_data):
@@ -19,6 +42,20 @@ def clean_data(raw_data):
     df_products = clean_products(df_products)
     df_staff = clean_staff(df_staff)
     
+    # Orders and line items share one order_id dictionary, so membership tests
+    # between the two compare integer codes instead of hashing strings
+    order_ids = pd.concat([df_orders['order_id'], df_line_items['order_id']]).dropna().unique()
+    order_id_dtype = pd.CategoricalDtype(order_ids)
+    df_orders['order_id'] = df_orders['order_id'].astype(order_id_dtype)
+    df_line_items['order_id'] = df_line_items['order_id'].astype(order_id_dtype)
+    
+    # Back the fact tables with Arrow so remaining string columns live in
+    # contiguous buffers and numeric reductions use Arrow compute kernels
+    df_orders = df_orders.convert_dtypes(dtype_backend='pyarrow')
+    df_line_items = df_line_items.convert_dtypes(dtype_backend='pyarrow')
+    df_orders = downcast_numerics(df_orders, ORDER_NUMERIC_DTYPES)
+    df_line_items = downcast_numerics(df_line_items, LINE_ITEM_NUMERIC_DTYPES)
+    
     return {
         'orders': df_orders,
         'line_items': df_line_items,
@@ -29,20 +66,20 @@ def clean_data(raw_data):
 
 def clean_orders(df):
     """Clean and normalize orders data"""
-    df = df.copy()
-    
     df['timestamp'] = pd.to_datetime(df['timestamp'])
     
-    df['timestamp_local'] = df.apply(
-        lambda row: convert_to_local_time(row['timestamp'], row['location_name']),
-        axis=1
-    )
+    df['timestamp_local'] = localize_timestamps(df)
     
     df['date'] = df['timestamp_local'].dt.date
     df['hour'] = df['timestamp_local'].dt.hour
     df['day_of_week'] = df['timestamp_local'].dt.day_name()
     
-    df['daypart'] = df['hour'].apply(get_daypart)
+    df['daypart'] = (
+        pd.cut(df['hour'].to_numpy(), bins=DAYPART_BINS, labels=DAYPART_LABELS, right=False)
+        .add_categories('Other')
+        .fillna('Other')
+        .remove_unused_categories()
+    )
     df['order_type'] = df['order_type'].str.lower().str.strip()
     df['order_type'] = df['order_type'].replace({
         'in-store': 'in_store',
@@ -52,38 +89,38 @@ def clean_orders(df):
     
     df['tender_type'] = df['tender_type'].str.lower().str.strip()
     
-    df['discount_rate'] = 0.0
+    discount = df['discount'].to_numpy(dtype=float)
     if 'subtotal' in df.columns:
-        mask = df['subtotal'] > 0
-        df.loc[mask, 'discount_rate'] = (df.loc[mask, 'discount'] / df.loc[mask, 'subtotal'] * 100).round(2)
+        subtotal = df['subtotal'].to_numpy(dtype=float)
     else:
-        df['reconstructed_subtotal'] = df['total'] + df['discount']
-        mask = df['reconstructed_subtotal'] > 0
-        df.loc[mask, 'discount_rate'] = (df.loc[mask, 'discount'] / df.loc[mask, 'reconstructed_subtotal'] * 100).round(2)
-        df = df.drop(columns=['reconstructed_subtotal'])
-    
-    df['discount_rate'] = df['discount_rate'].clip(-100, 100)
+        subtotal = df['total'].to_numpy(dtype=float) + discount
+    rate = np.round(discount / np.maximum(subtotal, 1e-9) * 100, 2)
+    df['discount_rate'] = np.where(subtotal > 0, np.clip(rate, -100, 100), 0.0)
+    df['has_discount'] = df['discount'].to_numpy() > 0
     
     df['time_id'] = df['timestamp_local'].dt.strftime('%Y%m%d%H')
     
+    df = to_categoricals(df, ORDER_CATEGORICAL_COLUMNS)
+    
+    # Downstream date-range filters rely on orders being sorted by date
+    df = df.sort_values(['date', 'hour'], kind='stable').reset_index(drop=True)
+    
     return df
 
 
 def clean_line_items(df):
     """Clean and normalize line items data"""
-    df = df.copy()
-    
     df['product_name'] = df['product_name'].str.strip().str.lower()
     df['category'] = df['category'].str.strip().str.title()
     df['margin'] = (df['unit_price'] - df['unit_cost']) * df['quantity']
     
+    df = to_categoricals(df, LINE_ITEM_CATEGORICAL_COLUMNS)
+    
     return df
 
 
 def clean_products(df):
     """Clean and normalize products data"""
-    df = df.copy()
-    
     df['name'] = df['name'].str.strip().str.lower()
     df['category'] = df['category'].str.strip().str.title()
     df['subcategory'] = df['subcategory'].str.strip().str.title()
@@ -94,14 +131,60 @@ def clean_products(df):
 
 def clean_staff(df):
     """Clean and normalize staff data"""
-    df = df.copy()
-    
-    df['name'] = df['staff_id'].apply(lambda x: f"Cashier_{x.split('_')[-1]}")
-    df = df.drop_duplicates(subset=['staff_id'], keep='first')
+    df = df.drop_duplicates(subset=['staff_id'], keep='first').assign(
+        name=lambda staff: 'Cashier_' + staff['staff_id'].astype(str).str.rsplit('_', n=1).str[-1]
+    )
     
     return df
 
 
+def to_categoricals(df, columns):
+    """Cast the given string columns to category dtype (missing columns are skipped)"""
+    return df.astype({col: 'category' for col in columns if col in df.columns})
+
+
+def downcast_numerics(df, dtypes):
+    """Cast numeric columns to narrower types (missing columns are skipped)
+    
+    Integer targets are only applied to columns holding whole numbers, so
+    fractional quantities such as weighed product are never truncated.
+    """
+    casts = {}
+    for col, dtype in dtypes.items():
+        if col not in df.columns:
+            continue
+        values = df[col].fillna(0)
+        if dtype.startswith(('int', 'uint')) and not (values.round() == values).all():
+            continue
+        casts[col] = dtype
+    return df.astype(casts)
+
+
+def localize_timestamps(df):
+    """Vectorized convert_to_local_time over the orders' timestamp column
+    
+    Converts each location's timestamps in one tz_localize/tz_convert call.
+    Columns of mixed UTC offsets parse to object dtype and fall back to the
+    per-row conversion.
+    """
+    if len(df) == 0 or not pd.api.types.is_datetime64_any_dtype(df['timestamp']):
+        return df.apply(
+            lambda row: convert_to_local_time(row['timestamp'], row['location_name']),
+            axis=1
+        )
+    
+    local = []
+    for location_name, timestamps in df.groupby('location_name', sort=False)['timestamp']:
+        location_tz = get_location_tz(location_name)
+        if timestamps.dt.tz is None:
+            # Same instants as pytz localize(): ambiguous wall times resolve to
+            # standard time and skipped ones keep their standard-time offset
+            local.append(timestamps.dt.tz_localize(location_tz, ambiguous=False, nonexistent=pd.Timedelta(hours=1)))
+        else:
+            local.append(timestamps.dt.tz_convert(location_tz))
+    return pd.concat(local)
+
+
 def convert_to_local_time(timestamp, location_name):
     """Convert timestamp to store-local time
     
@@ -110,11 +193,7 @@ def convert_to_local_time(timestamp, location_name):
     - UTC timestamps - converts to store local time
     - Any other timezone - converts to store local time
     """
-    from config import get_location_config
-    
-    location_config = get_location_config(location_name)
-    timezone_str = location_config['timezone']
-    location_tz = pytz.timezone(timezone_str)
+    location_tz = get_location_tz(location_name)
     
     if timestamp.tzinfo is None:
         # Assume naive timestamps are already in local store time
@@ -136,66 +215,64 @@ def get_daypart(hour):
 
 def detect_exceptions(df_orders):
     """Detect exceptions and anomalies in orders data"""
-    exceptions = []
-    
-    negative_mask = df_orders['total'] < THRESHOLDS['negative_total_threshold']
-    for _, row in df_orders[negative_mask].iterrows():
-        if not row['refunded']:
-            exceptions.append({
-                'type': 'negative_total',
-                'order_id': row['order_id'],
-                'location': row['location_name'],
-                'timestamp': row['timestamp_local'],
-                'value': row['total'],
-                'description': f"Negative total: ${row['total']:.2f}"
-            })
-    
-    high_discount_mask = df_orders['discount_rate'] > THRESHOLDS['discount_rate_high']
-    for _, row in df_orders[high_discount_mask].iterrows():
-        exceptions.append({
-            'type': 'high_discount',
-            'order_id': row['order_id'],
-            'location': row['location_name'],
-            'timestamp': row['timestamp_local'],
-            'value': row['discount_rate'],
-            'description': f"High discount rate: {row['discount_rate']:.1f}%"
-        })
-    
-    df_orders['calculated_tax'] = df_orders['excise_tax'] + df_orders['state_tax'] + df_orders['local_tax']
-    df_orders['tax_diff'] = abs(df_orders['total_tax'] - df_orders['calculated_tax'])
-    
-    tax_mismatch_mask = df_orders['tax_diff'] > 0.05
-    for _, row in df_orders[tax_mismatch_mask].iterrows():
-        exceptions.append({
-            'type': 'tax_mismatch',
-            'order_id': row['order_id'],
-            'location': row['location_name'],
-            'timestamp': row['timestamp_local'],
-            'value': row['tax_diff'],
-            'description': f"Tax mismatch: ${row['tax_diff']:.2f}"
-        })
-    
-    daily_voids = df_orders.groupby(['date', 'location_name'])['voided'].sum()
-    daily_median_voids = df_orders.groupby('location_name')['voided'].transform('median')
-    
-    staff_voids = df_orders.groupby('staff_id').agg({
+    total = df_orders['total'].to_numpy(dtype=np.float64)
+    refunded = df_orders['refunded'].to_numpy(dtype=bool)
+    discount_rate = df_orders['discount_rate'].to_numpy(dtype=np.float64)
+    calculated_tax = (
+        df_orders['excise_tax'].to_numpy(dtype=np.float64)
+        + df_orders['state_tax'].to_numpy(dtype=np.float64)
+        + df_orders['local_tax'].to_numpy(dtype=np.float64)
+    )
+    tax_diff = np.abs(df_orders['total_tax'].to_numpy(dtype=np.float64) - calculated_tax)
+    
+    negative_mask = (total < THRESHOLDS['negative_total_threshold']) & ~refunded
+    high_discount_mask = discount_rate > THRESHOLDS['discount_rate_high']
+    tax_mismatch_mask = tax_diff > 0.05
+    
+    exceptions = [
+        order_exceptions(df_orders, negative_mask, 'negative_total', total, "Negative total: ${:.2f}"),
+        order_exceptions(df_orders, high_discount_mask, 'high_discount', discount_rate, "High discount rate: {:.1f}%"),
+        order_exceptions(df_orders, tax_mismatch_mask, 'tax_mismatch', tax_diff, "Tax mismatch: ${:.2f}")
+    ]
+    
+    staff_voids = df_orders.groupby('staff_id', observed=True).agg({
         'voided': 'sum',
         'order_id': 'count'
     })
     staff_voids['void_rate'] = staff_voids['voided'] / staff_voids['order_id'] * 100
     
     high_void_staff = staff_voids[staff_voids['void_rate'] > 5.0]
-    for staff_id, row in high_void_staff.iterrows():
-        exceptions.append({
-            'type': 'high_void_rate',
-            'order_id': None,
-            'location': 'All',
-            'timestamp': None,
-            'value': row['void_rate'],
-            'description': f"Staff {staff_id}: {row['void_rate']:.1f}% void rate"
-        })
-    
-    return pd.DataFrame(exceptions)
+    void_rates = high_void_staff['void_rate'].to_numpy(dtype=np.float64)
+    exceptions.append(pd.DataFrame({
+        'type': 'high_void_rate',
+        'order_id': None,
+        'location': 'All',
+        # Typed like the order rows' timestamps so the concat keeps the tz-aware dtype
+        'timestamp': pd.Series(pd.NaT, index=range(len(void_rates)), dtype=exceptions[0]['timestamp'].dtype),
+        'value': void_rates,
+        'description': [
+            f"Staff {staff_id}: {rate:.1f}% void rate" for staff_id, rate in zip(high_void_staff.index, void_rates)
+        ]
+    }))
+    
+    exceptions = [block for block in exceptions if len(block) > 0]
+    if not exceptions:
+        return pd.DataFrame(columns=EXCEPTION_COLUMNS)
+    return pd.concat(exceptions, ignore_index=True)
+
+
+def order_exceptions(df_orders, mask, exception_type, values, description):
+    """Build the exception rows for orders flagged by a boolean mask"""
+    flagged = df_orders.loc[mask]
+    flagged_values = values[mask]
+    return pd.DataFrame({
+        'type': exception_type,
+        'order_id': flagged['order_id'].to_numpy(dtype=object),
+        'location': flagged['location_name'].to_numpy(dtype=object),
+        'timestamp': flagged['timestamp_local'].to_numpy(),
+        'value': flagged_values,
+        'description': [description.format(value) for value in flagged_values]
+    })
 
 
 def validate_data_quality(cleaned_data):
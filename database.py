@@ -1,9 +1,89 @@
 """
 Database module - DuckDB for local analytics
 """
+import itertools
+import json
+import threading
 import duckdb
 import pandas as pd
-from config import DB_PATH
+import pyarrow as pa
+from config import DB_PATH, DB_SETTINGS, DAYPARTS
+
+KPI_CACHE_SIZE = 64
+
+# Closed vocabularies stored as ENUMs (one-byte codes). order_type and
+# tender_type stay VARCHAR because uploaded exports can carry any value.
+ENUM_TYPES = {
+    "daypart_t": list(DAYPARTS) + ['Other'],
+    "day_of_week_t": ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+}
+
+# Dimensions come first so they exist before the facts that reference them.
+# Facts join dimensions on integer surrogate keys; the source ids are kept
+# only on the dimension rows. Fact money columns hold whole cents so the KPI
+# sums run on native integers instead of DECIMAL arithmetic.
+STAR_SCHEMA = {
+    "DimLocation": """
+        location_key INTEGER PRIMARY KEY,
+        location_id VARCHAR,
+        location_name VARCHAR,
+        timezone VARCHAR
+    """,
+    "DimStaff": """
+        staff_key INTEGER PRIMARY KEY,
+        staff_id VARCHAR,
+        staff_name VARCHAR
+    """,
+    "DimProduct": """
+        product_key INTEGER PRIMARY KEY,
+        product_id VARCHAR,
+        product_name VARCHAR,
+        category VARCHAR,
+        subcategory VARCHAR,
+        unit_cost DECIMAL(10,2),
+        unit_price DECIMAL(10,2)
+    """,
+    "DimTime": """
+        time_key INTEGER PRIMARY KEY,
+        time_id VARCHAR,
+        timestamp TIMESTAMP,
+        date DATE,
+        hour INTEGER,
+        daypart daypart_t,
+        day_of_week day_of_week_t
+    """,
+    "FactSales": """
+        order_id VARCHAR PRIMARY KEY,
+        location_key INTEGER,
+        staff_key INTEGER,
+        time_key INTEGER,
+        order_type VARCHAR,
+        is_medical BOOLEAN,
+        subtotal_cents BIGINT,
+        excise_tax_cents BIGINT,
+        state_tax_cents BIGINT,
+        local_tax_cents BIGINT,
+        total_tax_cents BIGINT,
+        discount_cents BIGINT,
+        discount_rate DECIMAL(5,2),
+        total_cents BIGINT,
+        tender_type VARCHAR,
+        voided BOOLEAN,
+        refunded BOOLEAN,
+        promo_code VARCHAR
+    """,
+    "FactLineItems": """
+        line_id VARCHAR PRIMARY KEY,
+        order_id VARCHAR,
+        product_key INTEGER,
+        quantity INTEGER,
+        unit_price_cents BIGINT,
+        unit_cost_cents BIGINT,
+        discount_cents BIGINT,
+        total_cents BIGINT,
+        margin_cents BIGINT
+    """
+}
 
 
 class DutchieDB:
@@ -12,10 +92,19 @@ class DutchieDB:
     def __init__(self, db_path=DB_PATH):
         self.db_path = db_path
         self.conn = None
+        # Filter key -> KPI tables for the currently loaded data
+        self._kpi_cache = {}
+        # One connection may be shared by several Streamlit sessions; DuckDB
+        # connections are not thread-safe, so every use of it is serialized
+        self._lock = threading.RLock()
+        self._kpi_runs = itertools.count()
     
     def connect(self):
         """Connect to DuckDB database"""
         self.conn = duckdb.connect(self.db_path)
+        for name, value in DB_SETTINGS.items():
+            self.conn.execute(f"SET {name} = '{value}'")
+        self.conn.execute("CREATE OR REPLACE TEMP MACRO cents(amount) AS CAST(round(amount * 100) AS BIGINT)")
         return self.conn
     
     def close(self):
@@ -25,106 +114,61 @@ class DutchieDB:
     
     def create_schema(self):
         """Create star schema tables"""
-        if not self.conn:
-            self.connect()
-        
-        self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS DimLocation (
-                location_id VARCHAR PRIMARY KEY,
-                location_name VARCHAR,
-                timezone VARCHAR
-            )
-        """)
-        
-        self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS DimStaff (
-                staff_id VARCHAR PRIMARY KEY,
-                staff_name VARCHAR
-            )
-        """)
-        
-        self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS DimProduct (
-                product_id VARCHAR PRIMARY KEY,
-                product_name VARCHAR,
-                category VARCHAR,
-                subcategory VARCHAR,
-                unit_cost DECIMAL(10,2),
-                unit_price DECIMAL(10,2)
-            )
-        """)
-        
-        self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS DimTime (
-                time_id VARCHAR PRIMARY KEY,
-                timestamp TIMESTAMP,
-                date DATE,
-                hour INTEGER,
-                daypart VARCHAR,
-                day_of_week VARCHAR
-            )
-        """)
+        existing_types = {
+            name for (name,) in self.conn.execute(
+                "SELECT type_name FROM duckdb_types() WHERE database_name = current_database()"
+            ).fetchall()
+        }
+        for name, values in ENUM_TYPES.items():
+            if name not in existing_types:
+                self.conn.execute(f"CREATE TYPE {name} AS ENUM ({enum_values_sql(values)})")
         
-        self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS FactSales (
-                order_id VARCHAR PRIMARY KEY,
-                location_id VARCHAR,
-                staff_id VARCHAR,
-                time_id VARCHAR,
-                order_type VARCHAR,
-                is_medical BOOLEAN,
-                subtotal DECIMAL(10,2),
-                excise_tax DECIMAL(10,2),
-                state_tax DECIMAL(10,2),
-                local_tax DECIMAL(10,2),
-                total_tax DECIMAL(10,2),
-                discount DECIMAL(10,2),
-                discount_rate DECIMAL(5,2),
-                total DECIMAL(10,2),
-                tender_type VARCHAR,
-                voided BOOLEAN,
-                refunded BOOLEAN,
-                promo_code VARCHAR
-            )
-        """)
-        
-        self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS FactLineItems (
-                line_id VARCHAR PRIMARY KEY,
-                order_id VARCHAR,
-                product_id VARCHAR,
-                quantity INTEGER,
-                unit_price DECIMAL(10,2),
-                unit_cost DECIMAL(10,2),
-                discount DECIMAL(10,2),
-                total DECIMAL(10,2),
-                margin DECIMAL(10,2)
-            )
-        """)
+        for table, columns in STAR_SCHEMA.items():
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
     
     def load_data(self, cleaned_data):
-        """Load cleaned data into star schema"""
-        if not self.conn:
-            self.connect()
+        """Load cleaned data into star schema
         
-        self.conn.execute("DELETE FROM FactLineItems")
-        self.conn.execute("DELETE FROM FactSales")
-        self.conn.execute("DELETE FROM DimTime")
-        self.conn.execute("DELETE FROM DimProduct")
-        self.conn.execute("DELETE FROM DimStaff")
-        self.conn.execute("DELETE FROM DimLocation")
+        The reload runs as one transaction, so readers never see a partially
+        replaced schema and DuckDB commits the rewritten tables once.
+        """
+        with self._lock:
+            self.conn.execute("BEGIN TRANSACTION")
+            try:
+                self._replace_tables(cleaned_data)
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            self._kpi_cache.clear()
+            # Refresh the optimizer's statistics for the new contents
+            self.conn.execute("ANALYZE")
+    
+    def _replace_tables(self, cleaned_data):
+        """Swap the star schema contents for cleaned_data inside the caller's transaction"""
+        # Recreating the tables drops their key indexes with the old rows;
+        # DuckDB rejects re-inserting a deleted key within one transaction.
+        # The ENUM types are recreated in between so they follow config.
+        for table in reversed(STAR_SCHEMA):
+            self.conn.execute(f"DROP TABLE IF EXISTS {table}")
+        for name, values in ENUM_TYPES.items():
+            self.conn.execute(f"DROP TYPE IF EXISTS {name}")
+            self.conn.execute(f"CREATE TYPE {name} AS ENUM ({enum_values_sql(values)})")
+        for table, columns in STAR_SCHEMA.items():
+            self.conn.execute(f"CREATE TABLE {table} ({columns})")
         
         df_products = cleaned_data['products'].drop_duplicates(subset=['product_id'])
         self.conn.execute("""
             INSERT INTO DimProduct 
-            SELECT product_id, name as product_name, category, subcategory, unit_cost, unit_price
+            SELECT row_number() OVER (ORDER BY product_id) as product_key,
+                   product_id, name as product_name, category, subcategory, unit_cost, unit_price
             FROM df_products
         """)
         
         df_staff = cleaned_data['staff'].drop_duplicates(subset=['staff_id'])
         self.conn.execute("""
             INSERT INTO DimStaff 
-            SELECT staff_id, name as staff_name
+            SELECT row_number() OVER (ORDER BY staff_id) as staff_key, staff_id, name as staff_name
             FROM df_staff
         """)
         
@@ -135,14 +179,24 @@ class DutchieDB:
         )
         self.conn.execute("""
             INSERT INTO DimLocation 
-            SELECT * FROM locations_df
+            SELECT row_number() OVER (ORDER BY location_id) as location_key, location_id, location_name, timezone
+            FROM locations_df
         """)
         
-        time_df = df_orders[['time_id', 'timestamp_local', 'date', 'hour', 'daypart', 'day_of_week']].drop_duplicates(subset=['time_id'])
-        time_df = time_df.rename(columns={'timestamp_local': 'timestamp'})
+        # time_id is the local YYYYMMDDHH, so it doubles as an ordered integer
+        # key; ordering by it lays both tables out chronologically and the row
+        # groups' min/max stats prune date filters. The calendar columns were
+        # derived in each store's own timezone during cleaning, so DuckDB only
+        # collapses them to one row per hour rather than re-deriving them.
+        time_df = df_orders[['time_id', 'timestamp_local', 'date', 'hour', 'daypart', 'day_of_week']]
+        self.conn.register('time_arrow', to_arrow(time_df))
         self.conn.execute("""
             INSERT INTO DimTime 
-            SELECT * FROM time_df
+            SELECT CAST(time_id AS INTEGER) as time_key, time_id, min(timestamp_local) as timestamp,
+                   any_value(date), any_value(hour), any_value(daypart), any_value(day_of_week)
+            FROM time_arrow
+            GROUP BY time_id
+            ORDER BY time_key
         """)
         
         sales_df = df_orders[[
@@ -150,9 +204,17 @@ class DutchieDB:
             'subtotal', 'excise_tax', 'state_tax', 'local_tax', 'total_tax', 
             'discount', 'discount_rate', 'total', 'tender_type', 'voided', 'refunded', 'promo_code'
         ]].drop_duplicates(subset=['order_id'])
+        self.conn.register('sales_arrow', to_arrow(sales_df))
         self.conn.execute("""
             INSERT INTO FactSales 
-            SELECT * FROM sales_df
+            SELECT s.order_id, dl.location_key, ds.staff_key, CAST(s.time_id AS INTEGER) as time_key,
+                   s.order_type, s.is_medical, cents(s.subtotal), cents(s.excise_tax), cents(s.state_tax),
+                   cents(s.local_tax), cents(s.total_tax), cents(s.discount), s.discount_rate, cents(s.total),
+                   s.tender_type, s.voided, s.refunded, s.promo_code
+            FROM sales_arrow s
+            LEFT JOIN DimLocation dl ON s.location_id = dl.location_id
+            LEFT JOIN DimStaff ds ON s.staff_id = ds.staff_id
+            ORDER BY time_key
         """)
         
         df_line_items = cleaned_data['line_items']
@@ -160,124 +222,202 @@ class DutchieDB:
             'line_id', 'order_id', 'product_id', 'quantity', 
             'unit_price', 'unit_cost', 'discount', 'total', 'margin'
         ]].drop_duplicates(subset=['line_id'])
+        self.conn.register('line_items_arrow', to_arrow(line_items_df))
         self.conn.execute("""
             INSERT INTO FactLineItems 
-            SELECT * FROM line_items_df
+            SELECT li.line_id, li.order_id, dp.product_key, li.quantity,
+                   cents(li.unit_price), cents(li.unit_cost), cents(li.discount), cents(li.total), cents(li.margin)
+            FROM line_items_arrow li
+            LEFT JOIN DimProduct dp ON li.product_id = dp.product_id
         """)
+        
+        for view in ('time_arrow', 'sales_arrow', 'line_items_arrow'):
+            self.conn.unregister(view)
+    
+    def query(self, sql, params=None):
+        """Execute SQL query, binding optional ? parameters, and return DataFrame"""
+        with self._lock:
+            return self.conn.execute(sql, params).df()
     
-    def query(self, sql):
-        """Execute SQL query and return DataFrame"""
-        if not self.conn:
-            self.connect()
-        return self.conn.execute(sql).df()
+    def query_arrow(self, sql, params=None):
+        """Execute SQL query, binding optional ? parameters, and return a pyarrow Table"""
+        with self._lock:
+            return self.conn.execute(sql, params).arrow()
     
     def get_kpis(self, filters=None):
-        """Get KPIs with optional filters"""
-        where_clauses = self._build_where_clause(filters)
-        
-        kpis = {}
-        
-        sql = f"""
-            SELECT 
-                SUM(CASE WHEN NOT voided THEN total ELSE 0 END) as net_sales,
-                COUNT(DISTINCT order_id) as total_orders,
-                AVG(CASE WHEN NOT voided THEN total ELSE NULL END) as aov,
-                SUM(CASE WHEN voided THEN 1 ELSE 0 END) as void_count,
-                SUM(CASE WHEN refunded THEN 1 ELSE 0 END) as refund_count
-            FROM FactSales fs
-            JOIN DimTime dt ON fs.time_id = dt.time_id
-            {where_clauses}
-        """
-        kpis['sales'] = self.query(sql)
-        
-        sql = f"""
-            SELECT 
-                tender_type,
-                SUM(CASE WHEN NOT voided THEN total ELSE 0 END) as sales,
-                COUNT(*) as transactions
-            FROM FactSales fs
-            JOIN DimTime dt ON fs.time_id = dt.time_id
-            {where_clauses}
-            GROUP BY tender_type
-            ORDER BY sales DESC
-        """
-        kpis['tender_mix'] = self.query(sql)
+        """Get KPIs with optional filters, as pyarrow Tables
         
-        sql = f"""
-            SELECT 
-                dp.product_name,
-                dp.category,
-                SUM(fli.quantity) as units_sold,
-                SUM(fli.total) as net_sales,
-                SUM(fli.margin) as total_margin
-            FROM FactLineItems fli
-            JOIN DimProduct dp ON fli.product_id = dp.product_id
-            JOIN FactSales fs ON fli.order_id = fs.order_id
-            JOIN DimTime dt ON fs.time_id = dt.time_id
-            {where_clauses.replace('WHERE', 'WHERE NOT fs.voided AND')}
-            GROUP BY dp.product_name, dp.category
-            ORDER BY net_sales DESC
-            LIMIT 10
+        Results are cached per filter set until the next load_data, so panels
+        sharing the same filters only run the queries once.
         """
-        kpis['top_products'] = self.query(sql)
+        key = json.dumps(filters or {}, sort_keys=True, default=str)
+        with self._lock:
+            if key not in self._kpi_cache:
+                if len(self._kpi_cache) >= KPI_CACHE_SIZE:
+                    self._kpi_cache.pop(next(iter(self._kpi_cache)))
+                self._kpi_cache[key] = self._compute_kpis(filters)
+            return dict(self._kpi_cache[key])
+    
+    def _compute_kpis(self, filters):
+        """Run the KPI queries for one filter set
         
-        sql = f"""
-            SELECT 
-                dp.category,
-                SUM(fli.total) as net_sales,
-                SUM(fli.margin) as total_margin
-            FROM FactLineItems fli
-            JOIN DimProduct dp ON fli.product_id = dp.product_id
-            JOIN FactSales fs ON fli.order_id = fs.order_id
-            JOIN DimTime dt ON fs.time_id = dt.time_id
-            {where_clauses.replace('WHERE', 'WHERE NOT fs.voided AND')}
-            GROUP BY dp.category
-            ORDER BY net_sales DESC
+        The filtered orders are materialized once into a temp table that every
+        KPI query reads, so FactSales is scanned and joined to DimTime once.
         """
-        kpis['category_mix'] = self.query(sql)
+        where_clauses, params = self._build_where_clause(filters)
+        # Temp tables get per-run names so no two runs ever share one
+        run = next(self._kpi_runs)
+        kpi_orders = f"kpi_orders_{run}"
+        kpi_products = f"kpi_products_{run}"
         
-        sql = f"""
-            SELECT 
-                dt.hour,
-                COUNT(*) as transactions,
-                SUM(CASE WHEN fs.voided THEN 1 ELSE 0 END) as voids,
-                SUM(CASE WHEN fs.discount > 0 THEN 1 ELSE 0 END) as discounted
+        self.conn.execute(f"""
+            CREATE OR REPLACE TEMP TABLE {kpi_orders} AS
+            SELECT fs.*, dt.hour
             FROM FactSales fs
-            JOIN DimTime dt ON fs.time_id = dt.time_id
+            JOIN DimTime dt ON fs.time_key = dt.time_key
             {where_clauses}
-            GROUP BY dt.hour
-            ORDER BY dt.hour
-        """
-        kpis['hourly'] = self.query(sql)
-        
-        return kpis
+        """, params)
+        try:
+            # Like the dashboard, a category filter also limits the product rollups
+            # to that category's line items, not every item in a matching order
+            category = (filters or {}).get('category')
+            item_filter = "WHERE dp.category = ?" if category else ""
+            item_params = [category] if category else None
+            
+            kpis = {}
+            
+            sql = f"""
+                SELECT 
+                    SUM(CASE WHEN NOT voided THEN total_cents ELSE 0 END) / 100.0 as net_sales,
+                    COUNT(DISTINCT order_id) as total_orders,
+                    AVG(CASE WHEN NOT voided THEN total_cents ELSE NULL END) / 100.0 as aov,
+                    SUM(CASE WHEN voided THEN 1 ELSE 0 END) as void_count,
+                    SUM(CASE WHEN refunded THEN 1 ELSE 0 END) as refund_count
+                FROM {kpi_orders}
+            """
+            kpis['sales'] = self.query_arrow(sql)
+            
+            sql = f"""
+                SELECT 
+                    tender_type,
+                    SUM(CASE WHEN NOT voided THEN total_cents ELSE 0 END) / 100.0 as sales,
+                    COUNT(*) as transactions
+                FROM {kpi_orders}
+                GROUP BY tender_type
+                ORDER BY sales DESC
+            """
+            kpis['tender_mix'] = self.query_arrow(sql)
+            
+            # Line items are rolled up per product over the filtered orders first,
+            # so the product dimension joins a few dozen rows instead of every item
+            self.conn.execute(f"""
+                CREATE OR REPLACE TEMP TABLE {kpi_products} AS
+                SELECT fli.product_key,
+                       SUM(fli.quantity) as units_sold,
+                       SUM(fli.total_cents) as net_sales_cents,
+                       SUM(fli.margin_cents) as margin_cents
+                FROM FactLineItems fli
+                WHERE fli.order_id IN (SELECT order_id FROM {kpi_orders} WHERE NOT voided)
+                GROUP BY fli.product_key
+            """)
+            
+            sql = f"""
+                SELECT 
+                    dp.product_name,
+                    dp.category,
+                    SUM(kp.units_sold) as units_sold,
+                    SUM(kp.net_sales_cents) / 100.0 as net_sales,
+                    SUM(kp.margin_cents) / 100.0 as total_margin
+                FROM {kpi_products} kp
+                JOIN DimProduct dp ON kp.product_key = dp.product_key
+                {item_filter}
+                GROUP BY dp.product_name, dp.category
+                ORDER BY net_sales DESC
+                LIMIT 10
+            """
+            kpis['top_products'] = self.query_arrow(sql, item_params)
+            
+            sql = f"""
+                SELECT 
+                    dp.category,
+                    SUM(kp.net_sales_cents) / 100.0 as net_sales,
+                    SUM(kp.margin_cents) / 100.0 as total_margin
+                FROM {kpi_products} kp
+                JOIN DimProduct dp ON kp.product_key = dp.product_key
+                {item_filter}
+                GROUP BY dp.category
+                ORDER BY net_sales DESC
+            """
+            kpis['category_mix'] = self.query_arrow(sql, item_params)
+            
+            sql = f"""
+                SELECT 
+                    hour,
+                    COUNT(*) as transactions,
+                    SUM(CASE WHEN voided THEN 1 ELSE 0 END) as voids,
+                    SUM(CASE WHEN discount_cents > 0 THEN 1 ELSE 0 END) as discounted
+                FROM {kpi_orders}
+                GROUP BY hour
+                ORDER BY hour
+            """
+            kpis['hourly'] = self.query_arrow(sql)
+            
+            return kpis
+        finally:
+            # Also on failure, or the shared connection would keep every failed run's tables
+            self.conn.execute(f"DROP TABLE IF EXISTS {kpi_products}")
+            self.conn.execute(f"DROP TABLE IF EXISTS {kpi_orders}")
     
     def _build_where_clause(self, filters):
-        """Build WHERE clause from filters"""
+        """Build WHERE clause from filters
+        
+        Returns (clause, params); filter values are bound as ? parameters so
+        the SQL text stays stable across filter values and is never spliced.
+        """
         if not filters:
-            return ""
+            return "", []
         
         clauses = []
+        params = []
         
         if filters.get('start_date') and filters.get('end_date'):
-            clauses.append(f"dt.date BETWEEN '{filters['start_date']}' AND '{filters['end_date']}'")
+            clauses.append("dt.date BETWEEN ? AND ?")
+            params.extend([filters['start_date'], filters['end_date']])
         
         if filters.get('locations'):
-            locations = "','".join(filters['locations'])
-            clauses.append(f"fs.location_id IN ('{locations}')")
+            clauses.append("fs.location_key IN (SELECT location_key FROM DimLocation WHERE location_id IN (SELECT UNNEST(?)))")
+            params.append(list(filters['locations']))
         
         if filters.get('order_type'):
-            clauses.append(f"fs.order_type = '{filters['order_type']}'")
+            clauses.append("fs.order_type = ?")
+            params.append(filters['order_type'])
         
         if filters.get('daypart'):
-            clauses.append(f"dt.daypart = '{filters['daypart']}'")
+            clauses.append("dt.daypart = ?")
+            params.append(filters['daypart'])
         
         if filters.get('category'):
-            clauses.append(f"EXISTS (SELECT 1 FROM FactLineItems fli JOIN DimProduct dp ON fli.product_id = dp.product_id WHERE fli.order_id = fs.order_id AND dp.category = '{filters['category']}')")
+            clauses.append("fs.order_id IN (SELECT fli.order_id FROM FactLineItems fli JOIN DimProduct dp ON fli.product_key = dp.product_key WHERE dp.category = ?)")
+            params.append(filters['category'])
         
         if filters.get('staff_id'):
-            clauses.append(f"fs.staff_id = '{filters['staff_id']}'")
+            clauses.append("fs.staff_key IN (SELECT staff_key FROM DimStaff WHERE staff_id = ?)")
+            params.append(filters['staff_id'])
         
         if clauses:
-            return "WHERE " + " AND ".join(clauses)
-        return ""
+            return "WHERE " + " AND ".join(clauses), params
+        return "", params
+
+
+def enum_values_sql(values):
+    """Quoted, comma-separated SQL literals for an ENUM definition"""
+    return ", ".join("'" + str(value).replace("'", "''") + "'" for value in values)
+
+
+def to_arrow(df):
+    """Arrow table over a cleaned fact frame for DuckDB's zero-copy Arrow scan
+    
+    The fact tables are already Arrow-backed, so this mostly rewraps their
+    buffers instead of copying them the way a pandas scan converts columns.
+    """
+    return pa.Table.from_pandas(df, preserve_index=False)
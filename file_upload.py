@@ -3,161 +3,94 @@ File upload and parsing module for Dutchie POS data
 Handles CSV uploads from POS exports
 """
 import pandas as pd
+import io
 import json
 from datetime import datetime
-import streamlit as st
-from difflib import get_close_matches
+from functools import lru_cache
 
+# Canonical field -> lowercase header spellings seen in POS exports, tried in order.
+# Fields are resolved in list order and a later field may claim a column an
+# earlier one matched.
+COLUMN_SYNONYMS = [
+    ('order_id', ['transaction_id', 'order_id', 'transactionid', 'receipt_id', 'receiptid', 'id']),
+    ('timestamp', ['transaction_date', 'timestamp', 'transactiondate', 'created_at', 'date', 'datetime', 'sale_time']),
+    ('staff_id', ['employee_id', 'staff_id', 'employeeid', 'cashier_id', 'cashierid', 'responsible', 'user_id']),
+    ('staff_name', ['employee_name', 'staff_name', 'employeename', 'cashier_name']),
+    ('product_id', ['product_id', 'productid', 'sku', 'item_id']),
+    ('category', ['category', 'product_category', 'item_category']),
+    ('quantity', ['quantity', 'qty', 'item_quantity']),
+    ('unit_price', ['unit_price', 'unitprice', 'price', 'item_price']),
+    ('unit_cost', ['unit_cost', 'unitcost', 'cost', 'item_cost']),
+    ('item_discount', ['item_discount', 'discount', 'total_discount', 'totaldiscount']),
+    ('order_discount', ['order_discount', 'total_discount']),
+    ('item_total', ['item_total', 'total', 'amount', 'totalprice']),
+    ('order_total', ['order_total', 'total_amount']),
+    ('order_subtotal', ['order_subtotal', 'subtotal', 'sub_total', 'beforetax']),
+    ('total_tax', ['tax', 'total_tax', 'totaltax', 'taxes']),
+    ('order_type', ['order_type', 'ordertype', 'type', 'channel']),
+    ('is_medical', ['is_medical', 'ismedical', 'medical']),
+    ('voided', ['voided', 'is_void', 'isvoid', 'void'])
+]
 
-def find_column(df, possible_names, fuzzy=True):
-    """
-    Find column by checking multiple possible names (case-insensitive)
-    Falls back to fuzzy matching if exact match not found
-    
-    Args:
-        df: DataFrame to search
-        possible_names: List of possible column names
-        fuzzy: Whether to use fuzzy matching as fallback
-        
-    Returns:
-        Column name if found, None otherwise
-    """
-    df_columns_lower = {col.lower(): col for col in df.columns}
-    
-    # Try exact match first
-    for name in possible_names:
-        if name.lower() in df_columns_lower:
-            return df_columns_lower[name.lower()]
-    
-    # Fallback to fuzzy matching if enabled
-    if fuzzy:
-        all_columns = list(df.columns)
-        for name in possible_names:
-            # Find close matches (80% similarity)
-            matches = get_close_matches(name.lower(), [c.lower() for c in all_columns], n=1, cutoff=0.6)
-            if matches:
-                # Return the original column name (not lowercase)
-                matched_col = [c for c in all_columns if c.lower() == matches[0]][0]
-                return matched_col
-    
-    return None
-    """
-    Parse uploaded CSV file from Dutchie POS export
-    
-    Args:
-        uploaded_file: Streamlit UploadedFile object
-        location_name: Name to assign to this location
-        
-    Returns:
-        dict with keys: orders, line_items, products, staff
-    """
-    try:
-        file_extension = uploaded_file.name.split('.')[-1].lower()
-        
-        if file_extension == 'csv':
-            return parse_csv_file(uploaded_file, location_name)
-        else:
-            raise ValueError(f"Unsupported file type: {file_extension}. Please upload CSV.")
-            
-    except Exception as e:
-        import traceback
-        st.error(f"Error parsing file: {str(e)}")
-        st.error(f"Traceback: {traceback.format_exc()}")
-        raise
+# Fields read as strings rather than inferred, so identifier-like values
+# such as zero-padded SKUs keep their exact text
+TEXT_FIELDS = {'staff_id', 'staff_name', 'product_id', 'product_name', 'category', 'subcategory', 'order_type', 'tender_type'}
+
+# Every field parse_csv_file reads; other columns are never loaded
+INPUT_FIELDS = {canonical for canonical, _ in COLUMN_SYNONYMS} | TEXT_FIELDS | {
+    'subtotal', 'excise_tax', 'state_tax', 'local_tax', 'discount', 'total', 'refunded', 'promo_code'
+}
+TENDER_NAMES = ('credit', 'debit', 'cash')
 
 
-def parse_csv_file(uploaded_file, location_name):
-    """Parse CSV file with POS transaction data"""
-    df = pd.read_csv(uploaded_file)
+@lru_cache(maxsize=32)
+def resolve_column_mapping(columns):
+    """Map a CSV header tuple to canonical field names
+    
+    Memoized on the header, so repeat uploads of the same export layout skip
+    the synonym search entirely.
+    """
+    columns_lower = [col.lower() for col in columns]
     
-    def find_column(df, patterns):
+    def find_column(patterns):
         """Find the first column matching any of the patterns"""
-        df_columns_lower = [col.lower() for col in df.columns]
         for pattern in patterns:
-            pattern_lower = pattern.lower()
-            for i, col in enumerate(df_columns_lower):
-                if col == pattern_lower:
-                    return df.columns[i]
-            for i, col in enumerate(df_columns_lower):
-                if pattern_lower in col or col in pattern_lower:
-                    return df.columns[i]
+            if pattern in columns_lower:
+                return columns[columns_lower.index(pattern)]
+            for col, col_lower in zip(columns, columns_lower):
+                if pattern in col_lower or col_lower in pattern:
+                    return col
         return None
     
     column_mapping = {}
-    
-    order_id_col = find_column(df, ['transaction_id', 'order_id', 'transactionid', 'receipt_id', 'receiptid', 'id'])
-    if order_id_col:
-        column_mapping[order_id_col] = 'order_id'
-    
-    timestamp_col = find_column(df, ['transaction_date', 'timestamp', 'transactiondate', 'created_at', 'date', 'datetime', 'sale_time'])
-    if timestamp_col:
-        column_mapping[timestamp_col] = 'timestamp'
-    
-    staff_col = find_column(df, ['employee_id', 'staff_id', 'employeeid', 'cashier_id', 'cashierid', 'responsible', 'user_id'])
-    if staff_col:
-        column_mapping[staff_col] = 'staff_id'
-    
-    staff_name_col = find_column(df, ['employee_name', 'staff_name', 'employeename', 'cashier_name'])
-    if staff_name_col:
-        column_mapping[staff_name_col] = 'staff_name'
-    
-    product_id_col = find_column(df, ['product_id', 'productid', 'sku', 'item_id'])
-    if product_id_col:
-        column_mapping[product_id_col] = 'product_id'
-    
-    category_col = find_column(df, ['category', 'product_category', 'item_category'])
-    if category_col:
-        column_mapping[category_col] = 'category'
-    
-    quantity_col = find_column(df, ['quantity', 'qty', 'item_quantity'])
-    if quantity_col:
-        column_mapping[quantity_col] = 'quantity'
-    
-    unit_price_col = find_column(df, ['unit_price', 'unitprice', 'price', 'item_price'])
-    if unit_price_col:
-        column_mapping[unit_price_col] = 'unit_price'
-    
-    unit_cost_col = find_column(df, ['unit_cost', 'unitcost', 'cost', 'item_cost'])
-    if unit_cost_col:
-        column_mapping[unit_cost_col] = 'unit_cost'
-    
-    item_discount_col = find_column(df, ['item_discount', 'discount', 'total_discount', 'totaldiscount'])
-    if item_discount_col:
-        column_mapping[item_discount_col] = 'item_discount'
-    
-    order_discount_col = find_column(df, ['order_discount', 'total_discount'])
-    if order_discount_col:
-        column_mapping[order_discount_col] = 'order_discount'
-    
-    item_total_col = find_column(df, ['item_total', 'total', 'amount', 'totalprice'])
-    if item_total_col:
-        column_mapping[item_total_col] = 'item_total'
-    
-    order_total_col = find_column(df, ['order_total', 'total_amount'])
-    if order_total_col:
-        column_mapping[order_total_col] = 'order_total'
-    
-    order_subtotal_col = find_column(df, ['order_subtotal', 'subtotal', 'sub_total', 'beforetax'])
-    if order_subtotal_col:
-        column_mapping[order_subtotal_col] = 'order_subtotal'
-    
-    tax_col = find_column(df, ['tax', 'total_tax', 'totaltax', 'taxes'])
-    if tax_col:
-        column_mapping[tax_col] = 'total_tax'
-    
-    order_type_col = find_column(df, ['order_type', 'ordertype', 'type', 'channel'])
-    if order_type_col:
-        column_mapping[order_type_col] = 'order_type'
-    
-    medical_col = find_column(df, ['is_medical', 'ismedical', 'medical'])
-    if medical_col:
-        column_mapping[medical_col] = 'is_medical'
-    
-    void_col = find_column(df, ['voided', 'is_void', 'isvoid', 'void'])
-    if void_col:
-        column_mapping[void_col] = 'voided'
+    for canonical, patterns in COLUMN_SYNONYMS:
+        col = find_column(patterns)
+        if col:
+            column_mapping[col] = canonical
+    return column_mapping
+
+
+def parse_csv_file(uploaded_file, location_name, compression=None):
+    """Parse CSV file (optionally compressed, e.g. 'gzip') with POS transaction data"""
+    # Peek at the header first so text columns can be typed up front and
+    # columns nothing reads are skipped; per-tender amount columns are kept
+    # for exports without a tender column
+    header = pd.read_csv(uploaded_file, nrows=0, compression=compression).columns
+    uploaded_file.seek(0)
+    column_mapping = resolve_column_mapping(tuple(header))
+    usecols = [
+        col for col in header
+        if column_mapping.get(col, col) in INPUT_FIELDS or any(name in col.lower() for name in TENDER_NAMES)
+    ]
+    dtype = {col: 'string[pyarrow]' for col in usecols if column_mapping.get(col, col) in TEXT_FIELDS}
+    
+    df = pd.read_csv(
+        uploaded_file, engine='pyarrow', dtype_backend='pyarrow', usecols=usecols, dtype=dtype, compression=compression
+    )
     
     df.rename(columns=column_mapping, inplace=True)
+    # Loose matching can map two source columns to one name; the first wins
+    df = df.loc[:, ~df.columns.duplicated()]
     required_columns = ['order_id', 'timestamp']
     missing_columns = [col for col in required_columns if col not in df.columns]
     
@@ -171,131 +104,118 @@ def parse_csv_file(uploaded_file, location_name):
     
     location_id = f"LOC_{location_name.upper().replace(' ', '_')}"
     
-    def safe_get(row, column, default, convert_type=None):
-        """Safely extract value from row with fallback"""
+    # Rows without an order id cannot be attributed; the rest are ordered by
+    # order id with each order's line items in file order
+    df = df[df['order_id'].notna()].sort_values('order_id', kind='stable')
+    
+    def number(column, default=0.0):
+        """Column as floats, with default where absent, missing or unparseable"""
         if column not in df.columns:
-            return default
-        
-        # Get value - handle both Series and dict-like access
-        try:
-            if isinstance(row, pd.Series):
-                val = row[column]
-            else:
-                val = row.get(column, default)
-        except (KeyError, AttributeError):
-            return default
-        
-        # Handle Series that might be returned
-        if isinstance(val, pd.Series):
-            if len(val) > 0:
-                val = val.iloc[0]
-            else:
-                return default
-        
-        # Check if it's NaN - now val should be scalar
-        try:
-            if pd.isna(val):
-                return default
-        except (TypeError, ValueError):
-            pass
-            
-        if convert_type:
-            try:
-                return convert_type(val)
-            except:
-                return default
-        return val
+            return default if isinstance(default, pd.Series) else pd.Series(float(default), index=df.index)
+        return pd.to_numeric(df[column], errors='coerce').astype(float).fillna(default)
     
-    orders = []
-    line_items = []
-    products = {}
-    staff = {}
+    def text(column, default):
+        """Column as strings, with default where absent or missing"""
+        if column not in df.columns:
+            return pd.Series(default, index=df.index, dtype=object)
+        values = df[column]
+        return values.astype(str).where(values.notna(), default)
     
-    grouped = df.groupby('order_id')
+    def flag(column, default=False):
+        """Column as truthiness flags, with default where absent or missing"""
+        if column not in df.columns:
+            return pd.Series(default, index=df.index, dtype=bool)
+        values = df[column].astype(object)
+        return values.where(values.notna(), default).astype(bool)
     
-    for order_id, group in grouped:
-        first_row = group.iloc[0]
-        
-        tender_type = 'cash'
-        
-        if 'tender_type' in df.columns and pd.notna(first_row.get('tender_type')):
-            tender_type = str(first_row['tender_type']).lower()
-        elif 'tender_type' not in df.columns:
-            for col in df.columns:
-                col_lower = col.lower()
-                val = first_row.get(col, 0)
-                if pd.notna(val) and isinstance(val, (int, float)) and val > 0:
-                    if 'credit' in col_lower:
-                        tender_type = 'credit'
-                        break
-                    elif 'debit' in col_lower:
-                        tender_type = 'debit'
-                        break
-                    elif 'cash' in col_lower:
-                        tender_type = 'cash'
-                        break
-        
-        order = {
-            'order_id': str(order_id),
-            'location_id': location_id,
-            'location_name': location_name,
-            'staff_id': str(safe_get(first_row, 'staff_id', 'unknown')),
-            'timestamp': str(safe_get(first_row, 'timestamp', datetime.now().isoformat())),
-            'order_type': safe_get(first_row, 'order_type', 'in-store', str),
-            'is_medical': safe_get(first_row, 'is_medical', False, bool),
-            'subtotal': safe_get(first_row, 'order_subtotal', safe_get(first_row, 'subtotal', 0, float), float),
-            'excise_tax': safe_get(first_row, 'excise_tax', 0, float),
-            'state_tax': safe_get(first_row, 'state_tax', 0, float),
-            'local_tax': safe_get(first_row, 'local_tax', 0, float),
-            'total_tax': safe_get(first_row, 'total_tax', 0, float),
-            'discount': safe_get(first_row, 'order_discount', safe_get(first_row, 'discount', 0, float), float),
-            'total': safe_get(first_row, 'order_total', safe_get(first_row, 'total', 0, float), float),
-            'tender_type': tender_type,
-            'voided': safe_get(first_row, 'voided', False, bool),
-            'refunded': safe_get(first_row, 'refunded', False, bool),
-            'promo_code': safe_get(first_row, 'promo_code', None)
-        }
-        orders.append(order)
-        
-        for idx, row in group.iterrows():
-            product_id = safe_get(row, 'product_id', f'prod_{idx}')
-            
-            line_item = {
-                'line_id': f'line_{idx}',
-                'order_id': str(order_id),
-                'product_id': str(product_id),
-                'product_name': safe_get(row, 'product_name', 'Unknown Product', str),
-                'category': safe_get(row, 'category', 'Other', str),
-                'quantity': safe_get(row, 'quantity', 1, float),
-                'unit_price': safe_get(row, 'unit_price', 0, float),
-                'unit_cost': safe_get(row, 'unit_cost', 0, float),
-                'discount': safe_get(row, 'item_discount', safe_get(row, 'discount', 0, float), float),
-                'total': safe_get(row, 'item_total', safe_get(row, 'total', 0, float), float)
-            }
-            line_items.append(line_item)
-            
-            products[product_id] = {
-                'product_id': str(product_id),
-                'name': safe_get(row, 'product_name', 'Unknown Product', str),
-                'category': safe_get(row, 'category', 'Other', str),
-                'subcategory': safe_get(row, 'subcategory', '', str),
-                'unit_cost': safe_get(row, 'unit_cost', 0, float),
-                'unit_price': safe_get(row, 'unit_price', 0, float)
-            }
-        
-        staff_id = safe_get(first_row, 'staff_id', 'unknown')
-        staff_id_str = str(staff_id) if staff_id != 'unknown' else 'unknown'
-        if staff_id_str and staff_id_str != 'unknown' and staff_id_str not in staff:
-            staff[staff_id_str] = {
-                'staff_id': staff_id_str,
-                'name': safe_get(first_row, 'staff_name', f'Staff_{staff_id_str}', str)
-            }
+    if 'tender_type' in df.columns:
+        tender_type = text('tender_type', 'cash').str.lower()
+    else:
+        # Exports without a tender column carry per-tender amount columns;
+        # the first positive one in column order names the tender
+        tender_type = pd.Series(None, index=df.index, dtype=object)
+        for col in df.columns:
+            col_lower = col.lower()
+            tender = next((name for name in TENDER_NAMES if name in col_lower), None)
+            if tender is None or not pd.api.types.is_numeric_dtype(df[col]):
+                continue
+            tender_type = tender_type.mask(tender_type.isna() & (df[col].fillna(0) > 0).to_numpy(dtype=bool), tender)
+        tender_type = tender_type.fillna('cash')
+    
+    timestamp = df['timestamp']
+    if pd.api.types.is_datetime64_any_dtype(timestamp):
+        timestamp = timestamp.fillna(pd.Timestamp.now(tz=timestamp.dt.tz))
+    else:
+        timestamp = text('timestamp', datetime.now().isoformat())
+    
+    promo_code = df['promo_code'].astype(object) if 'promo_code' in df.columns else pd.Series(None, index=df.index, dtype=object)
+    
+    rows = pd.DataFrame({
+        'order_id': df['order_id'].astype(str),
+        'location_id': location_id,
+        'location_name': location_name,
+        'staff_id': text('staff_id', 'unknown'),
+        'timestamp': timestamp,
+        'order_type': text('order_type', 'in-store'),
+        'is_medical': flag('is_medical'),
+        'subtotal': number('order_subtotal', number('subtotal')),
+        'excise_tax': number('excise_tax'),
+        'state_tax': number('state_tax'),
+        'local_tax': number('local_tax'),
+        'total_tax': number('total_tax'),
+        'discount': number('order_discount', number('discount')),
+        'total': number('order_total', number('total')),
+        'tender_type': tender_type,
+        'voided': flag('voided'),
+        'refunded': flag('refunded'),
+        'promo_code': promo_code.where(promo_code.notna(), None)
+    })
+    orders = rows.drop_duplicates('order_id')
+    
+    product_id = df['product_id'] if 'product_id' in df.columns else pd.Series(None, index=df.index, dtype=object)
+    product_id = product_id.astype(str).where(product_id.notna(), 'prod_' + df.index.astype(str))
+    product_name = text('product_name', 'Unknown Product')
+    category = text('category', 'Other')
+    unit_price = number('unit_price')
+    unit_cost = number('unit_cost')
+    
+    line_items = pd.DataFrame({
+        'line_id': 'line_' + df.index.astype(str),
+        'order_id': rows['order_id'],
+        'product_id': product_id,
+        'product_name': product_name,
+        'category': category,
+        'quantity': number('quantity', 1),
+        'unit_price': unit_price,
+        'unit_cost': unit_cost,
+        'discount': number('item_discount', number('discount')),
+        'total': number('item_total', number('total'))
+    })
+    
+    # Products keep the attributes of their last line item, listed in order
+    # of first appearance
+    products = pd.DataFrame({
+        'product_id': product_id,
+        'name': product_name,
+        'category': category,
+        'subcategory': text('subcategory', ''),
+        'unit_cost': unit_cost,
+        'unit_price': unit_price
+    })
+    first_seen = products['product_id'].drop_duplicates()
+    products = products.drop_duplicates('product_id', keep='last').set_index('product_id').loc[first_seen].reset_index()
+    
+    staff = pd.DataFrame({
+        'staff_id': orders['staff_id'],
+        'name': text('staff_name', None).loc[orders.index].fillna('Staff_' + orders['staff_id'])
+    })
+    staff = staff[~staff['staff_id'].isin(['unknown', ''])].drop_duplicates('staff_id')
     
     return {
-        'orders': orders,
-        'line_items': line_items,
-        'products': list(products.values()),
-        'staff': list(staff.values())
+        'orders': orders.reset_index(drop=True),
+        'line_items': line_items.reset_index(drop=True),
+        'products': products,
+        'staff': staff.reset_index(drop=True)
     }
 
 
@@ -309,7 +229,12 @@ def parse_json_file(uploaded_file, location_name):
         for order in data['orders']:
             order['location_id'] = location_id
             order['location_name'] = location_name
-        return data
+        return {
+            'orders': pd.DataFrame(data['orders']),
+            'line_items': pd.DataFrame(data['line_items']),
+            'products': pd.DataFrame(data.get('products', [])),
+            'staff': pd.DataFrame(data.get('staff', []))
+        }
     orders_data = data.get('orders') or data.get('receipts') or data.get('transactions') or []
     
     orders = []
@@ -377,10 +302,10 @@ def parse_json_file(uploaded_file, location_name):
             }
     
     return {
-        'orders': orders,
-        'line_items': line_items,
-        'products': list(products.values()),
-        'staff': list(staff.values())
+        'orders': pd.DataFrame(orders),
+        'line_items': pd.DataFrame(line_items),
+        'products': pd.DataFrame(list(products.values())),
+        'staff': pd.DataFrame(list(staff.values()))
     }
 
 
@@ -393,7 +318,7 @@ def parse_uploaded_file(uploaded_file, location_name):
         location_name: Name to assign to this location
         
     Returns:
-        Dictionary with orders, line_items, products, staff lists
+        Dictionary with orders, line_items, products, staff DataFrames
     """
     file_name = uploaded_file.name.lower()
     
@@ -401,10 +326,19 @@ def parse_uploaded_file(uploaded_file, location_name):
         return parse_json_file(uploaded_file, location_name)
     elif file_name.endswith('.csv'):
         return parse_csv_file(uploaded_file, location_name)
+    elif file_name.endswith('.csv.gz'):
+        return parse_csv_file(uploaded_file, location_name, compression='gzip')
     else:
         raise ValueError(f"Unsupported file type: {file_name}. Please upload CSV or JSON files.")
 
 
+def parse_uploaded_bytes(file_name, file_bytes, location_name):
+    """Parse raw upload bytes under the given file name"""
+    uploaded_file = io.BytesIO(file_bytes)
+    uploaded_file.name = file_name
+    return parse_uploaded_file(uploaded_file, location_name)
+
+
 def validate_uploaded_data(data):
     """Validate that uploaded data has required structure"""
     required_keys = ['orders', 'line_items', 'products', 'staff']
@@ -412,15 +346,14 @@ def validate_uploaded_data(data):
     for key in required_keys:
         if key not in data:
             return False, f"Missing required key: {key}"
-        if not isinstance(data[key], list):
-            return False, f"{key} must be a list"
+        if not isinstance(data[key], pd.DataFrame):
+            return False, f"{key} must be a DataFrame"
     
     if len(data['orders']) == 0:
         return False, "No orders found in uploaded file"
     
     required_order_fields = ['order_id', 'timestamp', 'total']
-    first_order = data['orders'][0]
-    missing_fields = [f for f in required_order_fields if f not in first_order]
+    missing_fields = [f for f in required_order_fields if f not in data['orders'].columns]
     
     if missing_fields:
         return False, f"Orders missing required fields: {missing_fields}"
@@ -3,72 +3,202 @@ Generate mock Dutchie POS CSV export files for testing
 This creates realistic POS export files that can be uploaded to the dashboard
 
 """
-import sys
-from datetime import datetime, timedelta
-from data_ingestion import generate_mock_data
-from config import LOCATIONS, MOCK_DATA_CONFIG
+import argparse
+import hashlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from itertools import repeat
+from datetime import date, datetime
+import config
+import data_ingestion
+from data_ingestion import MOCK_DATA_DIR, build_mock_data, mock_export_path, save_mock_data_to_csv
+from config import LOCATIONS, MOCK_DATA_CONFIG, available_cpus
 
-def generate_all_location_csvs(days=None):
-    """Generate CSV files for all locations configured in config.py"""
+# The configured locations, fixed for the life of this script
+LOCATION_NAMES = tuple(LOCATIONS)
+
+MANIFEST_FILE = "manifest.json"
+
+def shift_days(dt, days):
+    """dt moved by whole days via day ordinals, keeping its time of day"""
+    return datetime.combine(date.fromordinal(dt.toordinal() + days), dt.time())
+
+def mock_date_range(days):
+    """(start_date, end_date) covering days whole days and ending yesterday
+    
+    Computed once per run from a single datetime.now(), so every location is
+    generated over exactly the same range.
+    """
+    # End yesterday since today's data would be incomplete
+    end_date = shift_days(datetime.now(), -1)
+    start_date = shift_days(end_date, -(days - 1))  # -1 because we want 'days' total days including end_date
+    return start_date, end_date
+
+def start_run(days):
+    """Date range for a generator run, with the mock_data folder created once up front"""
+    os.makedirs(MOCK_DATA_DIR, exist_ok=True)
+    return mock_date_range(days)
+
+def export_key(location_name, start_date, end_date, compress):
+    """Digest of every setting that shapes a location's export"""
+    inputs = (LOCATIONS[location_name], start_date.date(), end_date.date(), MOCK_DATA_CONFIG, compress)
+    return hashlib.blake2b(repr(inputs).encode(), digest_size=8).hexdigest()
+
+def export_is_current(previous, entry):
+    """True if the previous manifest entry still describes entry's export
+    
+    The file must be the one this generator wrote for the same key (the
+    dashboard's mock loads overwrite exports in place) and newer than the
+    generator code.
+    """
+    if not previous or previous.get('key') != entry['key'] or previous.get('path') != entry['path']:
+        return False
+    try:
+        modified = os.path.getmtime(entry['path'])
+    except OSError:
+        return False
+    if modified != previous.get('modified'):
+        return False
+    return all(modified > os.path.getmtime(module.__file__) for module in (config, data_ingestion))
+
+def generate_location_csv(location_name, start_date, end_date, compress=False, force=False, previous=None):
+    """Generate one location's export and return (manifest entry, seconds taken)
+    
+    Module-level so worker processes can run it. Unless force is set, an
+    export that previous (its last manifest entry) shows is still current is
+    kept; previous is then returned as the entry and seconds is None.
+    """
+    path = mock_export_path(location_name, MOCK_DATA_CONFIG['export_format'], compress)
+    entry = {
+        'location': location_name,
+        'path': path,
+        'start_date': str(start_date.date()),
+        'end_date': str(end_date.date()),
+        'key': export_key(location_name, start_date, end_date, compress)
+    }
+    if not force and export_is_current(previous, entry):
+        return previous, None
+    
+    started = time.perf_counter()
+    # The per-file details end up in the manifest instead
+    with redirect_stdout(io.StringIO()):
+        mock_data = build_mock_data(location_name, start_date, end_date)
+        save_mock_data_to_csv(
+            mock_data, location_name, start_date, end_date, fmt=MOCK_DATA_CONFIG['export_format'], compress=compress
+        )
+    entry['transactions'] = len(mock_data['orders'])
+    entry['line_items'] = len(mock_data['line_items'])
+    entry['modified'] = os.path.getmtime(path)
+    return entry, time.perf_counter() - started
+
+def read_manifest():
+    """The mock_data manifest, location -> export entry; empty if missing or unreadable"""
+    try:
+        with open(os.path.join(MOCK_DATA_DIR, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_manifest(manifest, results):
+    """Merge (entry, seconds) results into the mock_data manifest and print one summary
+    
+    The manifest lists every generated export by location, with the key and
+    modification time that tell the next run whether it is still current, so
+    the files can be discovered without listing and parsing the folder.
+    """
+    manifest_path = os.path.join(MOCK_DATA_DIR, MANIFEST_FILE)
+    lines = []
+    for entry, seconds in results:
+        manifest[entry['location']] = entry
+        status = 'up to date' if seconds is None else f"{seconds:.2f}s"
+        lines.append(
+            f"{entry['location']:12s} {entry['transactions']:>7} transactions "
+            f"{entry['line_items']:>7} line items -> {entry['path']} ({status})"
+        )
+    
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print('\n'.join(lines))
+    print(f"Manifest: {manifest_path}")
+
+def generate_all_location_csvs(days=None, serial=False, compress=False, force=False):
+    """Generate CSV files for all locations configured in config.py
+    
+    Locations run in parallel worker processes unless serial is set, which
+    keeps everything in one process for debugging. compress writes .csv.gz;
+    force regenerates exports that are already up to date.
+    """
     if days is None:
         days = MOCK_DATA_CONFIG['days_of_data']
     
-    # End yesterday since today's data would be incomplete
-    end_date = datetime.now() - timedelta(days=1)
-    start_date = end_date - timedelta(days=days - 1)  # -1 because we want 'days' total days including end_date
+    start_date, end_date = start_run(days)
+    manifest = read_manifest()
+    previous = [manifest.get(location_name) for location_name in LOCATION_NAMES]
     
     print("Generating mock Dutchie POS export CSV files...")
     print(f"Date range: {start_date.date()} to {end_date.date()}")
-    print(f"Locations: {', '.join(LOCATIONS.keys())}\n")
+    print(f"Locations: {', '.join(LOCATION_NAMES)}\n")
     
-    for location_name in LOCATIONS.keys():
-        print(f"Generating data for {location_name}...")
-        mock_data = generate_mock_data(location_name, start_date, end_date)
-        print()
+    # Locations are independent, so generate them in separate processes; the
+    # pool never outgrows the locations or the CPUs actually available, and a
+    # single worker would only add process startup, so it runs in-process
+    workers = min(len(LOCATION_NAMES), available_cpus())
+    columns = (LOCATION_NAMES, repeat(start_date), repeat(end_date), repeat(compress), repeat(force), previous)
+    if serial or workers == 1:
+        results = list(map(generate_location_csv, *columns))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(generate_location_csv, *columns))
+    write_manifest(manifest, results)
 
-def generate_single_location_csv(location_name, days=None):
-    """Generate CSV file for a specific location"""
+def generate_single_location_csv(location_name, days=None, compress=False, force=False):
+    """Generate CSV file (.csv.gz if compress) for a specific location configured in config.py
+    
+    Returns the export's manifest entry, or None if the location is unknown.
+    """
     if days is None:
         days = MOCK_DATA_CONFIG['days_of_data']
     
     if location_name not in LOCATIONS:
         print(f"Error: Location '{location_name}' not found in config.py")
-        print(f"Available locations: {', '.join(LOCATIONS.keys())}")
+        print(f"Available locations: {', '.join(LOCATION_NAMES)}")
         print(f"\nTo add a new location, edit config.py and add to the LOCATIONS dict.")
-        return False
+        return None
     
-    # End yesterday since today's data would be incomplete
-    end_date = datetime.now() - timedelta(days=1)
-    start_date = end_date - timedelta(days=days - 1)
+    start_date, end_date = start_run(days)
     
     print(f"Generating mock data for {location_name}...")
     print(f"Date range: {start_date.date()} to {end_date.date()}\n")
-    
-    mock_data = generate_mock_data(location_name, start_date, end_date)
-    return True
+    manifest = read_manifest()
+    result = generate_location_csv(
+        location_name, start_date, end_date, compress, force, manifest.get(location_name)
+    )
+    write_manifest(manifest, [result])
+    return result[0]
 
 if __name__ == "__main__":
-    # Parse command line arguments
-    if len(sys.argv) == 1:
-        # No arguments - generate for all locations (7 days)
-        generate_all_location_csvs()
+    parser = argparse.ArgumentParser(description="Generate mock Dutchie POS export CSV files")
+    parser.add_argument('location', nargs='?', choices=LOCATION_NAMES,
+                        help="location to generate (default: all locations in config.py)")
+    parser.add_argument('days', nargs='?', type=int,
+                        help=f"days of data (default: {MOCK_DATA_CONFIG['days_of_data']})")
+    parser.add_argument('--serial', action='store_true', help="generate locations in one process, for debugging")
+    parser.add_argument('--gzip', action='store_true', help="write gzip-compressed .csv.gz files")
+    parser.add_argument('--force', action='store_true', help="regenerate exports that are already up to date")
+    args = parser.parse_args()
+    
+    if args.location is None:
+        generate_all_location_csvs(serial=args.serial, compress=args.gzip, force=args.force)
         print("\nAll CSV files generated successfully in the 'mock_data' folder")
-        
-    elif len(sys.argv) == 2:
-        # One argument - specific location (7 days)
-        location = sys.argv[1]
-        if generate_single_location_csv(location):
-            print(f"\nCSV file generated for {location} in the 'mock_data' folder")
-        
-    elif len(sys.argv) == 3:
-        # Two arguments - specific location and days
-        location = sys.argv[1]
-        try:
-            days = int(sys.argv[2])
-            if generate_single_location_csv(location, days):
-                print(f"\n {days} days of data generated for {location} in the 'mock_data' folder")
-        except ValueError:
-            print("Error: Days must be a number")
-            print("Usage: python generate_mock_csv.py Columbus")
+    elif args.days is None:
+        generate_single_location_csv(args.location, compress=args.gzip, force=args.force)
+        print(f"\nCSV file generated for {args.location} in the 'mock_data' folder")
+    else:
+        generate_single_location_csv(args.location, args.days, compress=args.gzip, force=args.force)
+        print(f"\n {args.days} days of data generated for {args.location} in the 'mock_data' folder")
     
     print("\nYou can now upload these files through the dashboard interface.")